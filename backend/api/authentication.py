@@ -0,0 +1,103 @@
+from collections import OrderedDict
+from copy import copy
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from api.cache import shared_cache
+from users.models import User
+
+TOKEN_KEY = 'auth:token:{}'
+
+
+class TokenCache:
+    """LRU кэш токен -> пользователь с ограниченным временем жизни.
+
+    Записи удаляются при выходе (удалении токена) и изменении
+    пользователя. Без AUTH_TOKEN_CACHE_SHARED записи хранятся в памяти
+    процесса, и другие процессы узнают об удалении только по истечении
+    AUTH_TOKEN_CACHE_TTL. С ним записи хранятся только в общем кэше,
+    поэтому удаление сразу видно всем процессам.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = Lock()
+        self._data = OrderedDict()
+
+    def get(self, key):
+        if settings.AUTH_TOKEN_CACHE_SHARED:
+            return shared_cache().get(TOKEN_KEY.format(key))
+        with self._lock:
+            user, expires_at = self._data.get(key, (None, 0))
+            if user is not None and expires_at > monotonic():
+                self._data.move_to_end(key)
+                return user
+            self._data.pop(key, None)
+        return None
+
+    def set(self, key, user):
+        if settings.AUTH_TOKEN_CACHE_SHARED:
+            shared_cache().set(TOKEN_KEY.format(key), user,
+                               settings.AUTH_TOKEN_CACHE_TTL)
+            return
+        with self._lock:
+            self._data[key] = (
+                user, monotonic() + settings.AUTH_TOKEN_CACHE_TTL)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+        if settings.AUTH_TOKEN_CACHE_SHARED:
+            shared_cache().delete_many(
+                [TOKEN_KEY.format(key) for key in keys])
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+token_cache = TokenCache(settings.AUTH_TOKEN_CACHE_SIZE)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к базе для недавно
+    проверенных токенов."""
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+        if user is not None:
+            # Копия, чтобы запросы не делили один объект пользователя.
+            user = copy(user)
+            return user, Token(key=key, user=user)
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, copy(user))
+        return user, token
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(instance, **kwargs):
+    # Повторно после коммита: параллельный запрос мог успеть
+    # закэшировать ещё не удалённый токен.
+    token_cache.delete(instance.key)
+    transaction.on_commit(lambda: token_cache.delete(instance.key))
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    keys = list(Token.objects.filter(user=instance).values_list(
+        'key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: token_cache.delete(*keys))
@@ -0,0 +1,273 @@
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+from time import monotonic, sleep, time, time_ns
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import (Favorite, Ingredient, MeasurementUnit, Recipe,
+                            Shoppinglist, Tag)
+from users.models import Subscriptions, User
+
+VERSION_KEY = 'reference:{}:version'
+CHANGED_KEY = 'reference:{}:changed'
+PAYLOAD_KEY = 'reference:{}:{}:{}'
+RESPONSE_KEY = 'response:{}'
+RESPONSE_LOCK_KEY = 'response:{}:lock'
+RESPONSE_POLL_INTERVAL = 0.05
+
+
+def shared_cache():
+    return caches[settings.REFERENCE_CACHE_ALIAS]
+
+
+def versions_shared():
+    """Видят ли все процессы одни и те же версии данных.
+
+    В кэше процесса (LocMemCache) изменение из другого воркера или
+    management команды не видно, поэтому версионированные кэши и ETag
+    в этом случае отключаются.
+    """
+    return not isinstance(shared_cache(), (LocMemCache, DummyCache))
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(**kwargs):
+    if versions_shared():
+        return []
+    return [checks.Warning(
+        f'Кэш {settings.REFERENCE_CACHE_ALIAS!r} локален для процесса, '
+        'кэши справочников, ответов и ETag отключены.',
+        hint='Укажите CACHE_BACKEND с файловым, Redis или Memcached '
+             'кэшем.',
+        id='api.W001',
+    )]
+
+
+def get_state(name):
+    """Версия и время последнего изменения данных name.
+
+    Начальная версия берётся из текущего времени, чтобы после
+    очистки кэша не повторялись уже выданные версии.
+    """
+    keys = (VERSION_KEY.format(name), CHANGED_KEY.format(name))
+    values = shared_cache().get_many(keys)
+    if len(values) < len(keys):
+        shared_cache().add(keys[0], time_ns() // 1000, None)
+        shared_cache().add(keys[1], time(), None)
+        values = shared_cache().get_many(keys)
+    return values.get(keys[0]), values.get(keys[1])
+
+
+def bump_version(name):
+    key = VERSION_KEY.format(name)
+    try:
+        version = shared_cache().incr(key)
+    except ValueError:
+        version = time_ns() // 1000
+        shared_cache().set(key, version, None)
+    shared_cache().set(CHANGED_KEY.format(name), time(), None)
+    return version
+
+
+class ReferenceCache:
+    """LRU кэш справочных данных процесса с версионированием.
+
+    Версия каждого справочника хранится в общем кэше Django и
+    увеличивается сигналами при изменении модели, поэтому устаревшие
+    записи просто перестают запрашиваться. Прочитанные версии тоже
+    хранятся не больше maxsize штук.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = Lock()
+        self._data = OrderedDict()
+        self._versions = OrderedDict()
+
+    def get_version(self, name):
+        if not versions_shared():
+            # Каждый вызов считается новой версией.
+            return object()
+        version, checked_at = self._versions.get(name, (None, 0))
+        if (version is None or monotonic() - checked_at
+                > settings.REFERENCE_CACHE_VERSION_TTL):
+            version = get_state(name)[0]
+            self._remember(name, version)
+        return version
+
+    def _remember(self, name, version):
+        with self._lock:
+            self._versions[name] = (version, monotonic())
+            self._versions.move_to_end(name)
+            if len(self._versions) > self.maxsize:
+                self._versions.popitem(last=False)
+
+    def bump_version(self, name):
+        self._remember(name, bump_version(name))
+
+    def get_or_set(self, name, key, default):
+        if not versions_shared():
+            return default()
+        version = self.get_version(name)
+        local_key = (name, version, key)
+        with self._lock:
+            if local_key in self._data:
+                self._data.move_to_end(local_key)
+                return self._data[local_key]
+        value = None
+        if settings.REFERENCE_CACHE_SHARED:
+            value = shared_cache().get(PAYLOAD_KEY.format(name, version, key))
+        if value is None:
+            value = default()
+            if settings.REFERENCE_CACHE_SHARED:
+                shared_cache().set(
+                    PAYLOAD_KEY.format(name, version, key), value)
+        with self._lock:
+            self._data[local_key] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._versions.clear()
+
+
+reference_cache = ReferenceCache(settings.REFERENCE_CACHE_SIZE)
+# Итоги списков покупок не вытесняют справочники из reference_cache.
+cart_cache = ReferenceCache(settings.CART_CACHE_SIZE)
+
+
+class ResponseCache:
+    """LRU кэш готовых ответов, одинаковых для всех анонимных посетителей.
+
+    В ключ входят версии данных, поэтому после изменений старые записи
+    просто перестают запрашиваться. Промах по ключу пересчитывает один
+    поток процесса, а с общим кэшем и один процесс: остальные ждут его
+    результат не дольше RESPONSE_CACHE_LOCK_TIMEOUT.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = Lock()
+        self._data = OrderedDict()
+        self._flights = {}
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                return self._data[key]
+        return None
+
+    def _store(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def _load_shared(self, key, default):
+        digest = sha1(repr(key).encode()).hexdigest()
+        payload_key = RESPONSE_KEY.format(digest)
+        lock_key = RESPONSE_LOCK_KEY.format(digest)
+        timeout = settings.RESPONSE_CACHE_LOCK_TIMEOUT
+        deadline = monotonic() + timeout
+        value = shared_cache().get(payload_key)
+        while value is None:
+            if shared_cache().add(lock_key, 1, timeout):
+                try:
+                    value = default()
+                    shared_cache().set(payload_key, value,
+                                       settings.RESPONSE_CACHE_TIMEOUT)
+                finally:
+                    shared_cache().delete(lock_key)
+            elif monotonic() > deadline:
+                value = default()
+            else:
+                sleep(RESPONSE_POLL_INTERVAL)
+                value = shared_cache().get(payload_key)
+        return value
+
+    def get_or_set(self, key, default):
+        if not versions_shared():
+            return default()
+        value = self._get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            flight = self._flights.setdefault(key, Lock())
+        try:
+            with flight:
+                value = self._get(key)
+                if value is None:
+                    if settings.RESPONSE_CACHE_SHARED:
+                        value = self._load_shared(key, default)
+                    else:
+                        value = default()
+                    self._store(key, value)
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+response_cache = ResponseCache(settings.RESPONSE_CACHE_SIZE)
+
+
+def bump_on_commit(name):
+    transaction.on_commit(lambda: reference_cache.bump_version(name))
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def bump_tag_version(**kwargs):
+    bump_on_commit('tag')
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver((post_save, post_delete), sender=MeasurementUnit)
+def bump_ingredient_version(**kwargs):
+    bump_on_commit('ingredient')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def bump_recipe_version(instance, **kwargs):
+    bump_on_commit('recipe')
+    name = f'recipe:{instance.pk}'
+    transaction.on_commit(lambda: bump_version(name))
+
+
+@receiver(post_delete, sender=Recipe)
+def bump_recipe_deletion_version(**kwargs):
+    # Подбор по ингредиентам после удалений строит индекс заново.
+    bump_on_commit('recipe_deletion')
+
+
+@receiver(post_save, sender=User)
+def bump_author_version(created=False, update_fields=None, **kwargs):
+    # У нового пользователя ещё нет рецептов.
+    if created or update_fields and set(update_fields) == {'last_login'}:
+        return
+    bump_on_commit('recipe')
+    bump_on_commit('author')
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=Shoppinglist)
+@receiver((post_save, post_delete), sender=Subscriptions)
+def bump_user_version(instance, **kwargs):
+    name = f'user:{instance.user_id}'
+    transaction.on_commit(lambda: bump_version(name))
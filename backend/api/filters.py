@@ -1,30 +1,70 @@
 import django_filters
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import (Case, Exists, F, FloatField, IntegerField,
+                              OuterRef, Value, When)
+from django.db.models.functions import Cast
+from django_filters.fields import ModelMultipleChoiceField
 
-from recipes.models import Ingredient, Recipe
+from api.search import ingredient_index, recipe_index
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeTag,
+                            Shoppinglist, Tag)
+
+TRUE_VALUES = ('1', 'true', 'True')
 
 
 class IngregientFilter(django_filters.FilterSet):
-    name = django_filters.CharFilter(
-        field_name='name',
-        lookup_expr='icontains',
-    )
+    name = django_filters.CharFilter(method='filter_name')
 
     class Meta:
         model = Ingredient
         fields = ('name',)
 
+    def filter_name(self, queryset, name, value):
+        """Совпадения по началу названия выводятся раньше остальных."""
+        if connection.vendor == 'postgresql':
+            return queryset.filter(name__icontains=value).annotate(
+                is_prefix=Case(
+                    When(name__istartswith=value, then=Value(0)),
+                    default=Value(1),
+                    output_field=IntegerField(),
+                )
+            ).order_by('is_prefix', 'name')
+        ids = ingredient_index.search(value, settings.INGREDIENT_SEARCH_LIMIT)
+        if not ids:
+            return queryset.none()
+        return queryset.filter(id__in=ids).order_by(Case(
+            *(When(id=pk, then=Value(position))
+              for position, pk in enumerate(ids)),
+            output_field=IntegerField(),
+        ))
+
+
+class SlugMultipleChoiceField(ModelMultipleChoiceField):
+    """Выбор тегов по slug без учёта регистра."""
+
+    def _check_values(self, value):
+        return super()._check_values([slug.lower() for slug in value])
+
+
+class SlugMultipleChoiceFilter(django_filters.ModelMultipleChoiceFilter):
+    field_class = SlugMultipleChoiceField
+
 
 class RecipeFilter(django_filters.FilterSet):
     is_favorited = django_filters.CharFilter(
         method='get_is_favorited'
     )
-    tags = django_filters.AllValuesMultipleFilter(
-        field_name='tags__slug',
-        lookup_expr="iexact"
+    tags = SlugMultipleChoiceFilter(
+        to_field_name='slug',
+        queryset=Tag.objects.all(),
+        method='get_tags'
     )
     is_in_shopping_cart = django_filters.CharFilter(
         method='get_is_in_shopping_cart'
     )
+    search = django_filters.CharFilter(method='get_search')
 
     class Meta:
         model = Recipe
@@ -32,13 +72,45 @@ class RecipeFilter(django_filters.FilterSet):
             'is_favorited',
             'tags',
             'author',
-            'is_in_shopping_cart'
+            'is_in_shopping_cart',
+            'search'
         )
 
+    def get_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.filter(Exists(RecipeTag.objects.filter(
+            recipes=OuterRef('pk'), tags__in=value)))
+
+    def get_search(self, queryset, name, value):
+        """Полнотекстовый поиск, в search_rank записывается релевантность."""
+        if connection.vendor == 'postgresql':
+            query = SearchQuery(value, config=settings.SEARCH_CONFIG,
+                                search_type='websearch')
+            return queryset.filter(search_vector=query).annotate(
+                # real -> double, чтобы значение в курсоре пагинации
+                # сравнивалось с рангом точно.
+                search_rank=Cast(SearchRank(F('search_vector'), query),
+                                 FloatField()))
+        ranks = recipe_index.search(value, settings.RECIPE_SEARCH_LIMIT)
+        if not ranks:
+            return queryset.none().annotate(
+                search_rank=Value(0.0, output_field=FloatField()))
+        return queryset.filter(id__in=ranks).annotate(search_rank=Case(
+            *(When(id=pk, then=Value(rank)) for pk, rank in ranks.items()),
+            output_field=FloatField(),
+        ))
+
+    def filter_by_user(self, queryset, model, value):
+        if value not in TRUE_VALUES:
+            return queryset
+        if self.request.user.is_anonymous:
+            return queryset.none()
+        return queryset.filter(Exists(model.objects.filter(
+            user=self.request.user, recipe=OuterRef('pk'))))
+
     def get_is_favorited(self, queryset, name, value):
-        if self.request.user.is_authenticated and value:
-            return queryset.filter(recipe_favorite__user=self.request.user)
+        return self.filter_by_user(queryset, Favorite, value)
 
     def get_is_in_shopping_cart(self, queryset, name, value):
-        if self.request.user.is_authenticated and value:
-            return queryset.filter(recipe_shoppinglist__user=self.request.user)
+        return self.filter_by_user(queryset, Shoppinglist, value)
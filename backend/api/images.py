@@ -0,0 +1,123 @@
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+from threading import BoundedSemaphore
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image, features
+
+from api.cache import bump_version, reference_cache
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+image_executor = ThreadPoolExecutor(
+    settings.IMAGE_WORKERS, thread_name_prefix='images')
+# Декодирование в запросе не должно ждать фоновые копии картинок.
+decode_slots = BoundedSemaphore(settings.IMAGE_DECODE_WORKERS)
+
+FORMATS = {
+    'jpeg': ('jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+if features.check('webp'):
+    FORMATS['webp'] = ('webp', {'quality': 80, 'method': 4})
+
+
+class RecipeImageField(Base64ImageField):
+    """Base64 картинка; одновременно декодируется не больше
+    IMAGE_DECODE_WORKERS картинок."""
+
+    def to_internal_value(self, data):
+        with decode_slots:
+            return super().to_internal_value(data)
+
+
+def make_renditions(name):
+    """Уменьшенные копии картинки в JPEG и WebP: {размер: {формат: путь}}."""
+    stem = PurePosixPath(name).stem
+    renditions = {}
+    with default_storage.open(name) as file:
+        original = Image.open(file)
+        original.load()
+    original = original.convert('RGB')
+    for size_name, size in settings.IMAGE_RENDITIONS.items():
+        image = original.copy()
+        image.thumbnail(size, Image.LANCZOS)
+        renditions[size_name] = {}
+        for image_format, (extension, options) in FORMATS.items():
+            buffer = io.BytesIO()
+            image.save(buffer, image_format, **options)
+            # Имя копии задано именем картинки: повторная сборка
+            # перезаписывает файлы, а не создаёт новые.
+            path = (f'{settings.IMAGE_RENDITIONS_DIR}{stem}_{size_name}'
+                    f'.{extension}')
+            default_storage.delete(path)
+            renditions[size_name][image_format] = default_storage.save(
+                path, ContentFile(buffer.getvalue()))
+    return renditions
+
+
+def rendition_paths(renditions):
+    return {path for paths in renditions.values() for path in paths.values()}
+
+
+def delete_renditions(paths):
+    for path in paths:
+        default_storage.delete(path)
+
+
+def build_renditions(recipe_id, name):
+    try:
+        renditions = make_renditions(name)
+    except Exception:
+        logger.exception('Не удалось обработать картинку %s', name)
+        return
+    old = Recipe.objects.filter(pk=recipe_id).values_list(
+        'image_renditions', flat=True).first() or {}
+    if Recipe.objects.filter(pk=recipe_id, image=name).update(
+            image_renditions=renditions):
+        delete_renditions(rendition_paths(old) - rendition_paths(renditions))
+        reference_cache.bump_version('recipe')
+        bump_version(f'recipe:{recipe_id}')
+    else:
+        # Картинку успели заменить или рецепт удалён.
+        delete_renditions(rendition_paths(renditions))
+
+
+def build_renditions_in_background(recipe_id, name):
+    try:
+        build_renditions(recipe_id, name)
+    finally:
+        close_old_connections()
+
+
+def schedule_renditions(recipe):
+    if recipe.image:
+        image_executor.submit(
+            build_renditions_in_background, recipe.pk, recipe.image.name)
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_renditions(instance, **kwargs):
+    paths = rendition_paths(instance.image_renditions)
+    if paths:
+        transaction.on_commit(lambda: delete_renditions(paths))
+
+
+def renditions_urls(recipe, request=None):
+    urls = {}
+    for size_name, paths in recipe.image_renditions.items():
+        urls[size_name] = {}
+        for image_format, path in paths.items():
+            url = default_storage.url(path)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[size_name][image_format] = url
+    return urls
@@ -0,0 +1,49 @@
+from statistics import median
+from time import perf_counter
+
+from django.core.management import BaseCommand, call_command
+
+from api.views import RecipeViewSet
+from foodgram.settings import PAGE_SIZE
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Замер сортировок ленты рецептов на растущем наборе данных.
+
+    Для каждого размера набор дополняется через generate_data,
+    затем замеряется первая страница каждой сортировки.
+    """
+
+    help = 'Сравнивает сортировки ленты рецептов по времени ответа.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[1000, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--explain', action='store_true')
+
+    def first_page(self, ordering):
+        return list(Recipe.objects.order_by(*ordering)
+                    .values_list('id', flat=True)[:PAGE_SIZE])
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            missing = size - Recipe.objects.count()
+            if missing > 0:
+                call_command('generate_data', recipes=missing,
+                             users=max(missing // 10, 1),
+                             stdout=self.stdout)
+            for name, ordering in RecipeViewSet.orderings.items():
+                timings = []
+                for _ in range(options['repeat']):
+                    started = perf_counter()
+                    self.first_page(ordering)
+                    timings.append(perf_counter() - started)
+                self.stdout.write(
+                    f'{size} {name}: median '
+                    f'{median(timings) * 1000:.2f} ms')
+                if options['explain']:
+                    self.stdout.write(
+                        Recipe.objects.order_by(*ordering)[:PAGE_SIZE]
+                        .explain())
@@ -0,0 +1,297 @@
+from collections import Counter, defaultdict
+from statistics import quantiles
+from time import perf_counter
+from urllib.parse import quote
+
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.middleware import fingerprint
+from api.urls import router
+from recipes.models import Favorite, Recipe, Tag
+from users.models import User
+
+PASSWORD = 'bench-password'
+BATCH = 10
+# Управление транзакциями не считается: SQLite пишет BEGIN в журнал
+# запросов, PostgreSQL нет, а бюджеты должны совпадать на обеих базах.
+TRANSACTION_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT',
+                          'RELEASE SAVEPOINT')
+
+# (название, маршрут, метод, параметры пути, строка запроса, клиент,
+#  тело запроса, бюджет запросов к базе). Параметры, строка запроса и
+# тело берутся из контекста набора данных. Пары POST/DELETE идут
+# подряд, чтобы каждый круг начинался с одного и того же состояния.
+SCENARIOS = (
+    ('теги', 'tag-list', 'get', {}, '', 'anon', None, 0),
+    ('тег', 'tag-detail', 'get', {'pk': 'tag'}, '', 'anon', None, 0),
+    ('ингредиенты: поиск', 'ingredient-list', 'get', {},
+     'name={prefix}', 'anon', None, 0),
+    ('ингредиент', 'ingredient-detail', 'get', {'pk': 'ingredient'}, '',
+     'anon', None, 1),
+    ('рецепты', 'recipe-list', 'get', {}, '', 'anon', None, 4),
+    ('рецепты: кэш ответов', 'recipe-list', 'get', {}, '', 'anon', None, 0),
+    ('рецепты: тег', 'recipe-list', 'get', {}, 'tags={tag_slug}', 'anon',
+     None, 5),
+    ('рецепты: популярные', 'recipe-list', 'get', {}, 'ordering=popular',
+     'anon', None, 4),
+    ('рецепты: поиск', 'recipe-list', 'get', {}, 'search={search}', 'anon',
+     None, 6),
+    ('рецепт', 'recipe-detail', 'get', {'pk': 'recipe'}, '', 'anon', None,
+     0),
+    ('что приготовить', 'recipe-cook', 'get', {},
+     'ingredients={cook_ingredients}', 'anon', None, 5),
+    ('рецепты: автор', 'recipe-list', 'get', {}, '', 'user', None, 5),
+    ('рецепты: избранное', 'recipe-list', 'get', {}, 'is_favorited=1',
+     'user', None, 5),
+    ('рецепты: покупки', 'recipe-list', 'get', {}, 'is_in_shopping_cart=1',
+     'user', None, 5),
+    ('рецепт: автор', 'recipe-detail', 'get', {'pk': 'recipe'}, '', 'user',
+     None, 4),
+    ('изменение рецепта', 'recipe-detail', 'patch', {'pk': 'own_recipe'},
+     '', 'user', 'patch', 12),
+    ('в избранное', 'recipe-favorite', 'post', {'pk': 'free_recipe'}, '',
+     'user', None, 3),
+    ('из избранного', 'recipe-favorite', 'delete', {'pk': 'free_recipe'},
+     '', 'user', None, 2),
+    ('в покупки', 'recipe-shopping-cart', 'post', {'pk': 'free_recipe'},
+     '', 'user', None, 7),
+    ('из покупок', 'recipe-shopping-cart', 'delete',
+     {'pk': 'free_recipe'}, '', 'user', None, 5),
+    ('в избранное пачкой', 'recipe-favorite-batch', 'post', {}, '',
+     'user', 'batch', 3),
+    ('из избранного пачкой', 'recipe-favorite-batch', 'delete', {}, '',
+     'user', 'batch', 3),
+    ('в покупки пачкой', 'recipe-shopping-cart-batch', 'post', {}, '',
+     'user', 'batch', 7),
+    ('из покупок пачкой', 'recipe-shopping-cart-batch', 'delete', {}, '',
+     'user', 'batch', 6),
+    ('список покупок', 'recipe-cart', 'get', {}, '', 'user', None, 1),
+    ('скачать список покупок', 'recipe-download-shopping-cart', 'get', {},
+     'type=txt', 'user', None, 0),
+    ('пользователи', 'user-list', 'get', {}, '', 'anon', None, 2),
+    ('пользователь', 'user-detail', 'get', {'id': 'author'}, '', 'user',
+     None, 2),
+    ('текущий пользователь', 'user-me', 'get', {}, '', 'user', None, 1),
+    ('подписаться', 'user-subscribe', 'post', {'id': 'author'}, '', 'user',
+     None, 4),
+    ('отписаться', 'user-subscribe', 'delete', {'id': 'author'}, '',
+     'user', None, 1),
+    ('подписки', 'users/subscriptions-list', 'get', {}, 'recipes_limit=3',
+     'user', None, 3),
+    ('регистрация', 'user-list', 'post', {}, '', 'anon', 'signup', 4),
+    ('вход', 'login', 'post', {}, '', 'anon', 'login', 4),
+    ('выход', 'logout', 'post', {}, '', 'login', None, 3),
+    ('статистика', 'stats', 'get', {}, '', 'admin', None, 0),
+)
+
+# Маршруты djoser для писем и смены учётных данных: в проекте не
+# используются либо упираются в хэширование пароля, а не в базу.
+SKIPPED_ROUTES = {
+    'api-root', 'user-activation', 'user-resend-activation',
+    'user-reset-password', 'user-reset-password-confirm',
+    'user-reset-username', 'user-reset-username-confirm',
+    'user-set-password', 'user-set-username',
+}
+
+
+class Command(BaseCommand):
+    """Замер всех маршрутов API на синтетическом наборе данных.
+
+    Набор создаётся generate_data в отдельной тестовой базе, маршруты
+    вызываются тестовым клиентом по кругу. Для каждого сценария
+    выводятся p50/p95, запросов в секунду и число запросов к базе.
+    Команда завершается с ошибкой, если сценарий превысил бюджет
+    запросов, ответил ошибкой или у маршрута нет сценария, поэтому её
+    можно запускать в CI. Создание и удаление рецепта не замеряются:
+    копии картинок строятся в фоновых потоках. Параллельную нагрузку
+    на запущенный сервер даёт loadtest.
+    """
+
+    help = 'Задержки и бюджеты запросов к базе по всем маршрутам API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--ingredients', type=int, default=500)
+        parser.add_argument('--rounds', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--keepdb', action='store_true')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def check_coverage(self):
+        covered = {scenario[1] for scenario in SCENARIOS}
+        missing = sorted(
+            {url.name for url in router.urls} - covered - SKIPPED_ROUTES)
+        if missing:
+            raise CommandError(
+                f'Нет сценариев для маршрутов: {", ".join(missing)}')
+
+    def generate(self, options):
+        missing = options['recipes'] - Recipe.objects.count()
+        if missing > 0:
+            call_command(
+                'generate_data', users=options['users'], recipes=missing,
+                ingredients=options['ingredients'], seed=options['seed'],
+                stdout=self.stdout)
+
+    def get_context(self):
+        user = User.objects.filter(
+            recipes__isnull=False, user_shoppinglist__isnull=False,
+            user__isnull=False).first()
+        if user is None:
+            raise CommandError('Не удалось выбрать пользователя из набора.')
+        login_user = User.objects.exclude(pk=user.pk).first()
+        login_user.set_password(PASSWORD)
+        login_user.save()
+        admin, _ = User.objects.get_or_create(
+            username='bench-admin', email='bench-admin@example.com',
+            defaults={'is_staff': True, 'is_superuser': True})
+        own_recipe = Recipe.objects.filter(author=user).prefetch_related(
+            'recipe_ingredients', 'tags').first()
+        free_recipes = list(Recipe.objects.exclude(
+            recipe_favorite__user=user).exclude(
+            recipe_shoppinglist__user=user).exclude(
+            pk=own_recipe.pk).values_list('pk', flat=True)[:BATCH + 1])
+        tag = Tag.objects.first()
+        return {
+            'users': {
+                'user': Token.objects.get_or_create(user=user)[0].key,
+                'admin': Token.objects.get_or_create(user=admin)[0].key,
+            },
+            'tag': tag.pk,
+            'tag_slug': tag.slug,
+            'ingredient': own_recipe.ingredient_ids[0],
+            'prefix': own_recipe.recipe_ingredients.all()[0]
+            .ingredients.name[:3],
+            'search': own_recipe.name.split()[0],
+            'recipe': Favorite.objects.values_list(
+                'recipe', flat=True).first(),
+            'own_recipe': own_recipe.pk,
+            'free_recipe': free_recipes[0],
+            'cook_ingredients': ','.join(
+                map(str, own_recipe.ingredient_ids[:5])),
+            'author': User.objects.exclude(pk=user.pk).exclude(
+                subscribing__user=user).exclude(pk=admin.pk).first().pk,
+            'payloads': {
+                'batch': {'recipes': free_recipes[1:]},
+                'patch': {
+                    'ingredients': [
+                        {'id': row.ingredients_id, 'amount': row.amount}
+                        for row in own_recipe.recipe_ingredients.all()],
+                    'tags': [tag.pk for tag in own_recipe.tags.all()],
+                    'name': 'Рецепт',
+                    'text': own_recipe.text,
+                    'cooking_time': own_recipe.cooking_time,
+                },
+                'login': {'email': login_user.email, 'password': PASSWORD},
+            },
+        }
+
+    def get_client(self, name, context):
+        client = APIClient()
+        token = context['users'].get(name)
+        if token:
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        return client
+
+    def request(self, scenario, context, number):
+        label, url_name, method, kwargs, query, client, payload, _ = scenario
+        path = reverse(f'api:{url_name}', kwargs={
+            key: context[value] for key, value in kwargs.items()})
+        if query:
+            path = f'{path}?{quote(query.format(**context), safe="=&,")}'
+        data = context['payloads'].get(payload)
+        if payload == 'signup':
+            data = {'email': f'signup{number}@example.com',
+                    'username': f'signup{number}', 'first_name': 'Bench',
+                    'last_name': 'Bench', 'password': PASSWORD}
+        client = self.get_client(client, context)
+        with CaptureQueriesContext(connection) as captured:
+            started = perf_counter()
+            response = getattr(client, method)(path, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            duration = perf_counter() - started
+        queries = [query['sql'] for query in captured
+                   if not query['sql'].startswith(TRANSACTION_STATEMENTS)]
+        if payload == 'login' and response.status_code == 200:
+            context['users']['login'] = response.json()['auth_token']
+        return path, response.status_code, duration, queries
+
+    def run_rounds(self, context, options):
+        durations = defaultdict(list)
+        query_counts = defaultdict(list)
+        worst = {}
+        errors = {}
+        paths = {}
+        for number in range(options['warmup'] + options['rounds']):
+            for index, scenario in enumerate(SCENARIOS):
+                path, status, duration, queries = self.request(
+                    scenario, context, number)
+                paths[index] = path
+                if status >= 400:
+                    errors[index] = status
+                if number < options['warmup']:
+                    continue
+                durations[index].append(duration)
+                query_counts[index].append(len(queries))
+                if len(queries) >= max(query_counts[index]):
+                    worst[index] = queries
+        return paths, durations, query_counts, worst, errors
+
+    def report(self, paths, durations, query_counts, worst, errors):
+        failures = []
+        for index, scenario in enumerate(SCENARIOS):
+            label, _, method, *_, budget = scenario
+            timings = durations[index]
+            percentiles = quantiles(timings, n=100)
+            count = max(query_counts[index])
+            self.stdout.write(
+                f'{method.upper():6} {paths[index]}\n'
+                f'       {label}: p50 {percentiles[49] * 1000:.1f} ms, '
+                f'p95 {percentiles[94] * 1000:.1f} ms, '
+                f'{len(timings) / sum(timings):.0f} req/s, '
+                f'запросов к базе {count} (бюджет {budget})')
+            if index in errors:
+                failures.append(f'{label}: ответ {errors[index]}')
+            if count > budget:
+                repeated = [
+                    f'{total} x {sql[:200]}' for sql, total in Counter(
+                        fingerprint(sql) for sql in worst[index]
+                    ).most_common(3)]
+                failures.append(
+                    f'{label}: {count} запросов к базе при бюджете '
+                    f'{budget}\n    ' + '\n    '.join(repeated))
+        return failures
+
+    def handle(self, *args, **options):
+        if options['rounds'] < 2:
+            raise CommandError('Нужно хотя бы два круга.')
+        self.check_coverage()
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            # Без кэширования версий и истечения токенов число запросов
+            # к базе не зависит от длительности круга.
+            with override_settings(REFERENCE_CACHE_VERSION_TTL=0,
+                                   AUTH_TOKEN_CACHE_TTL=24 * 60 * 60):
+                self.generate(options)
+                results = self.run_rounds(self.get_context(), options)
+                failures = self.report(*results)
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+        if failures:
+            raise CommandError(
+                'Замер не пройден:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Бюджеты соблюдены.'))
@@ -0,0 +1,23 @@
+from django.core.management import BaseCommand
+
+from api.images import build_renditions
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Создание уменьшенных копий картинок для существующих рецептов."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Пересоздать копии для всех рецептов.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_renditions={})
+        count = 0
+        for recipe_id, name in recipes.values_list('id', 'image').iterator():
+            build_renditions(recipe_id, name)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {count}'))
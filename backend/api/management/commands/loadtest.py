@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+from time import perf_counter
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+from django.core.management import BaseCommand
+
+READ_ONLY_PATHS = (
+    '/api/recipes/',
+    '/api/tags/',
+    '/api/ingredients/?name=а',
+)
+
+
+class Command(BaseCommand):
+    """Нагрузочный тест запущенного сервера.
+
+    Для сравнения sync и async запустите команду против
+    gunicorn foodgram.wsgi и против
+    gunicorn -k uvicorn.workers.UvicornWorker foodgram.asgi:application
+    (ASYNC_API=True) с одинаковым числом воркеров.
+    """
+
+    help = 'Нагрузочный тест API: пропускная способность и задержки.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--path', action='append', dest='paths')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--token')
+
+    def fetch(self, url, token):
+        request = Request(url)
+        if token:
+            request.add_header('Authorization', f'Token {token}')
+        started = perf_counter()
+        try:
+            with urlopen(request) as response:
+                response.read()
+                status = response.status
+        except HTTPError as error:
+            status = error.code
+        return status, perf_counter() - started
+
+    def handle(self, *args, **options):
+        for path in options['paths'] or READ_ONLY_PATHS:
+            url = options['url'] + quote(path, safe='/?=&')
+            started = perf_counter()
+            with ThreadPoolExecutor(options['concurrency']) as executor:
+                results = list(executor.map(
+                    lambda _: self.fetch(url, options['token']),
+                    range(options['requests'])))
+            elapsed = perf_counter() - started
+            timings = sorted(timing for _, timing in results)
+            percentiles = quantiles(timings, n=100)
+            errors = sum(1 for status, _ in results if status >= 400)
+            self.stdout.write(
+                f'{path}: {len(results) / elapsed:.1f} req/s, '
+                f'p50 {percentiles[49] * 1000:.1f} ms, '
+                f'p95 {percentiles[94] * 1000:.1f} ms, '
+                f'ошибок {errors}')
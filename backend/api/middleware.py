@@ -0,0 +1,192 @@
+import logging
+import re
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+IN_LISTS = re.compile(r'\((?:%s, )+%s\)')
+
+current_recorder = ContextVar('current_recorder', default=None)
+
+
+def fingerprint(sql):
+    """SQL без литералов и длины списков IN для поиска N+1."""
+    return IN_LISTS.sub('(...)', LITERALS.sub('?', sql))
+
+
+class RequestRecorder:
+    """Запросы к базе и время сериализации одного HTTP запроса."""
+
+    def __init__(self):
+        self.queries = Counter()
+        self.db_time = 0
+        self.serializer_time = 0
+        self.serializing = False
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    def duplicates(self, limit=5):
+        return [(sql, count) for sql, count in self.queries.most_common(limit)
+                if count > 1]
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.db_time += perf_counter() - started
+        recorder.queries[fingerprint(sql)] += 1
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def install_serializer_timer():
+    """Замеряет внешний вызов Serializer.data, вложенные не учитываются."""
+    original = BaseSerializer.data.fget
+    if getattr(original, 'timed', False):
+        return
+
+    def data(self):
+        recorder = current_recorder.get()
+        if recorder is None or recorder.serializing:
+            return original(self)
+        recorder.serializing = True
+        started = perf_counter()
+        try:
+            return original(self)
+        finally:
+            recorder.serializer_time += perf_counter() - started
+            recorder.serializing = False
+
+    data.timed = True
+    BaseSerializer.data = property(data)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+
+    def add(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+
+    def as_dict(self):
+        labels = [f'<={bound}' for bound in self.buckets]
+        labels.append(f'>{self.buckets[-1]}')
+        return dict(zip(labels, self.counts))
+
+
+class RouteStats:
+    """Гистограммы времени ответа и числа запросов по маршрутам
+    в пределах процесса."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._routes = {}
+
+    def add(self, route, duration, recorder):
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = {
+                    'count': 0,
+                    'queries': 0,
+                    'db_ms': 0,
+                    'duration_ms': Histogram(DURATION_BUCKETS),
+                    'query_count': Histogram(QUERY_BUCKETS),
+                }
+            stats['count'] += 1
+            stats['queries'] += recorder.query_count
+            stats['db_ms'] += recorder.db_time * 1000
+            stats['duration_ms'].add(duration * 1000)
+            stats['query_count'].add(recorder.query_count)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                route: {
+                    'count': stats['count'],
+                    'avg_queries': round(stats['queries'] / stats['count'],
+                                         2),
+                    'avg_db_ms': round(stats['db_ms'] / stats['count'], 2),
+                    'duration_ms': stats['duration_ms'].as_dict(),
+                    'query_count': stats['query_count'].as_dict(),
+                }
+                for route, stats in self._routes.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+
+route_stats = RouteStats()
+
+
+class RequestStatsMiddleware:
+    """Число запросов к базе, время базы и сериализации по запросам.
+
+    Включается переменной окружения REQUEST_STATS=True. Метрики
+    отдаются в заголовке Server-Timing, медленные запросы пишутся в
+    лог с повторяющимися SQL, сводка по маршрутам доступна
+    администраторам на /api/stats/.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        connection_created.connect(install_query_recorder)
+        for connection in connections.all():
+            install_query_recorder(connection)
+        install_serializer_timer()
+
+    def __call__(self, request):
+        recorder = RequestRecorder()
+        token = current_recorder.set(recorder)
+        started = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        duration = perf_counter() - started
+        size = None if response.streaming else len(response.content)
+        response['Server-Timing'] = ', '.join(filter(None, (
+            f'db;dur={recorder.db_time * 1000:.1f};'
+            f'desc="{recorder.query_count} queries"',
+            f'serializer;dur={recorder.serializer_time * 1000:.1f}',
+            f'total;dur={duration * 1000:.1f}',
+            size is not None and f'size;desc="{size} bytes"',
+        )))
+        match = request.resolver_match
+        route = match.route if match else 'unresolved'
+        route_stats.add(f'{request.method} {route}', duration, recorder)
+        if (duration * 1000 > settings.SLOW_REQUEST_MS
+                or recorder.query_count > settings.SLOW_REQUEST_QUERIES):
+            logger.warning(
+                'Медленный запрос %s %s: %.0f мс, %d запросов к базе '
+                '(%.0f мс), повторы: %s',
+                request.method, request.get_full_path(), duration * 1000,
+                recorder.query_count, recorder.db_time * 1000,
+                recorder.duplicates())
+        return response
@@ -1,4 +1,12 @@
-from rest_framework import mixins, viewsets
+from hashlib import sha1
+from math import ceil
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework import mixins, status, viewsets
+from rest_framework.response import Response
+
+from api.cache import get_state, versions_shared
 
 
 class ListRetrieveViewSet(mixins.ListModelMixin,
@@ -6,3 +14,56 @@ class ListRetrieveViewSet(mixins.ListModelMixin,
                           viewsets.GenericViewSet):
     """Mixins для GET запроса."""
     pass
+
+
+class NotModified(Exception):
+    pass
+
+
+class ConditionalGetMixin:
+    """ETag и Last-Modified для GET запросов.
+
+    Валидаторы строятся по версиям данных из cache_state, поэтому
+    ответ 304 отдаётся без обращения к базе и сериализатору.
+    """
+    cache_state = ()
+
+    def get_cache_state(self):
+        return self.cache_state
+
+    def get_validators(self, request, states):
+        key = '|'.join([request.get_full_path(), str(request.user.pk)]
+                       + [str(version) for version, _ in states])
+        etag = f'"{sha1(key.encode()).hexdigest()}"'
+        last_modified = max(changed for _, changed in states)
+        return etag, ceil(last_modified)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.validators = None
+        self.cache_versions = None
+        if request.method not in ('GET', 'HEAD') or not versions_shared():
+            return
+        states = [get_state(name) for name in self.get_cache_state()]
+        self.cache_versions = tuple(version for version, _ in states)
+        self.validators = self.get_validators(request, states)
+        etag, last_modified = self.validators
+        if get_conditional_response(request, etag=etag,
+                                    last_modified=last_modified):
+            raise NotModified
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs)
+        if getattr(self, 'validators', None) and response.status_code in (
+                status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            etag, last_modified = self.validators
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ('Authorization',))
+        return response
@@ -1,7 +1,149 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (Cursor, CursorPagination,
+                                       PageNumberPagination)
+from rest_framework.utils.urls import replace_query_param
+
+from foodgram.settings import MAX_PAGE_SIZE, PAGE_SIZE
+
+
+class KeysetPagination(CursorPagination):
+    """Пагинация по ключу без COUNT(*) и OFFSET.
+
+    Курсор хранит значения всех полей сортировки последней строки
+    страницы, следующая страница выбирается составным сравнением
+    (поле, pub_date, id), поэтому повторы в первом поле сортировки
+    (популярность, время приготовления, релевантность) не сводят её
+    к OFFSET.
+    """
+
+    page_size = PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+    ordering = ('-pub_date', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        return getattr(view, 'cursor_ordering', self.ordering)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            if len(cursor['p']) != len(self.ordering):
+                raise ValueError
+            position = [self.to_python(field, value) for field, value
+                        in zip(self.ordering, cursor['p'])]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(offset=0, reverse=bool(cursor.get('r')),
+                      position=position)
+
+    def encode_cursor(self, cursor):
+        # str() сохраняет микросекунды pub_date, нужные для сравнения.
+        encoded = urlsafe_b64encode(json.dumps(
+            {'p': cursor.position, 'r': int(cursor.reverse)},
+            default=str).encode()).decode('ascii')
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, encoded)
+
+    def to_python(self, field, value):
+        name = field.lstrip('-')
+        try:
+            return self.model._meta.get_field(name).to_python(value)
+        except FieldDoesNotExist:
+            # Аннотации вроде search_rank.
+            return float(value)
+
+    def position_filter(self, position, reverse):
+        """Строки после position: (a, b, c) > (x, y, z) с учётом
+        направлений, с явной границей по первому полю для индекса."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') != reverse else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        first = self.ordering[0]
+        lookup = 'lte' if first.startswith('-') != reverse else 'gte'
+        return Q(**{f'{first.lstrip("-")}__{lookup}': position[0]}) & (
+            condition)
+
+    def get_position(self, instance):
+        return [getattr(instance, field.lstrip('-'))
+                for field in self.ordering]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        if self.cursor is not None:
+            queryset = queryset.filter(
+                self.position_filter(self.cursor.position, reverse))
+        ordering = self.ordering
+        if reverse:
+            ordering = [field[1:] if field.startswith('-') else f'-{field}'
+                        for field in ordering]
+        results = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=False, position=self.get_position(
+                self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=True, position=self.get_position(
+                self.page[0])))
 
 
 class Pagination(PageNumberPagination):
-    """Кастомный класс пагинации."""
+    """Кастомный класс пагинации.
+
+    По умолчанию постраничная, с параметром cursor переключается на
+    пагинацию по ключу (только для QuerySet и представлений с
+    cursor_ordering).
+    """
+
+    page_size = PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = MAX_PAGE_SIZE
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (KeysetPagination.cursor_query_param in request.query_params
+                and isinstance(queryset, QuerySet)
+                and hasattr(view, 'cursor_ordering')):
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.keyset = None
+        return super().paginate_queryset(queryset, request, view)
 
-    page_size = 6
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,197 @@
+import re
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from datetime import timedelta
+from threading import Lock
+
+from django.utils import timezone
+
+from api.cache import reference_cache
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+
+WORD = re.compile(r'\w+')
+# Веса полей как у A/B/C поискового вектора PostgreSQL.
+NAME_WEIGHT = 1.0
+TEXT_WEIGHT = 0.4
+INGREDIENT_WEIGHT = 0.2
+# Запас на транзакции, закоммиченные позже начала прошлой синхронизации.
+SYNC_OVERLAP = timedelta(minutes=1)
+
+
+class IngredientPrefixIndex:
+    """Отсортированный массив названий ингредиентов для автодополнения."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._names = None
+        self._ids = None
+        self._version = None
+
+    def _get(self):
+        version = reference_cache.get_version('ingredient')
+        with self._lock:
+            if self._version != version:
+                rows = sorted(
+                    (name.lower(), pk) for pk, name
+                    in Ingredient.objects.values_list('id', 'name')
+                )
+                self._names = [name for name, _ in rows]
+                self._ids = [pk for _, pk in rows]
+                self._version = version
+            return self._names, self._ids
+
+    def search(self, value, limit):
+        """Id ингредиентов: сначала совпадения по префиксу, затем по
+        подстроке."""
+        names, ids = self._get()
+        value = value.lower()
+        result = []
+        position = bisect_left(names, value)
+        while (position < len(names) and len(result) < limit
+               and names[position].startswith(value)):
+            result.append(ids[position])
+            position += 1
+        if len(result) < limit:
+            for name, pk in zip(names, ids):
+                if value in name and not name.startswith(value):
+                    result.append(pk)
+                    if len(result) == limit:
+                        break
+        return result
+
+
+ingredient_index = IngredientPrefixIndex()
+
+
+class RecipeInvertedIndex:
+    """Обратный индекс рецептов в памяти для баз без полнотекстового
+    поиска (SQLite в тестах и разработке).
+
+    Слово запроса совпадает с любым словом индекса, начинающимся с него.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._postings = None
+        self._words = None
+        self._version = None
+
+    def _build(self):
+        postings = defaultdict(lambda: defaultdict(float))
+
+        def add(pk, value, weight):
+            for word in WORD.findall(value.lower()):
+                postings[word][pk] += weight
+
+        for pk, name, text in Recipe.objects.values_list(
+                'id', 'name', 'text').iterator():
+            add(pk, name, NAME_WEIGHT)
+            add(pk, text, TEXT_WEIGHT)
+        for pk, name in RecipeIngredient.objects.values_list(
+                'recipes_id', 'ingredients__name').iterator():
+            add(pk, name, INGREDIENT_WEIGHT)
+        return dict(postings), sorted(postings)
+
+    def _get(self):
+        version = (reference_cache.get_version('recipe'),
+                   reference_cache.get_version('ingredient'))
+        with self._lock:
+            if self._version != version:
+                self._postings, self._words = self._build()
+                self._version = version
+            return self._postings, self._words
+
+    def search(self, value, limit):
+        """Словарь {id рецепта: ранг} для рецептов со всеми словами
+        запроса, не больше limit лучших."""
+        postings, words = self._get()
+        ranks = None
+        for term in WORD.findall(value.lower()):
+            matched = defaultdict(float)
+            position = bisect_left(words, term)
+            while (position < len(words)
+                   and words[position].startswith(term)):
+                for pk, rank in postings[words[position]].items():
+                    matched[pk] += rank
+                position += 1
+            if ranks is None:
+                ranks = matched
+            else:
+                ranks = {pk: rank + matched[pk]
+                         for pk, rank in ranks.items() if pk in matched}
+            if not ranks:
+                return {}
+        if ranks is None:
+            return {}
+        best = sorted(ranks.items(), key=lambda item: -item[1])[:limit]
+        return dict(best)
+
+
+recipe_index = RecipeInvertedIndex()
+
+
+class RecipeIngredientMatcher:
+    """Подбор рецептов по имеющимся ингредиентам.
+
+    Хранит отсортированные id ингредиентов каждого рецепта
+    (Recipe.ingredient_ids) и обратные списки ингредиент -> рецепты,
+    так что подбор проходит только по рецептам с общими ингредиентами.
+    При смене версии 'recipe' дочитываются рецепты, сохранённые после
+    прошлой синхронизации; при смене версии 'recipe_deletion' индекс
+    строится заново.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._recipes = {}
+        self._postings = defaultdict(set)
+        self._version = None
+        self._deletions = None
+        self._synced_at = None
+
+    def _store(self, pk, ingredient_ids):
+        for ingredient_id in self._recipes.get(pk, ()):
+            self._postings[ingredient_id].discard(pk)
+        self._recipes[pk] = ingredient_ids
+        for ingredient_id in ingredient_ids:
+            self._postings[ingredient_id].add(pk)
+
+    def _sync(self):
+        version = reference_cache.get_version('recipe')
+        deletions = reference_cache.get_version('recipe_deletion')
+        if (self._version, self._deletions) == (version, deletions):
+            return
+        started = timezone.now()
+        recipes = Recipe.objects.all()
+        if self._synced_at is not None and self._deletions == deletions:
+            recipes = recipes.filter(
+                pub_date__gte=self._synced_at - SYNC_OVERLAP)
+        else:
+            self._recipes = {}
+            self._postings = defaultdict(set)
+        for pk, ingredient_ids in recipes.values_list(
+                'id', 'ingredient_ids').iterator():
+            self._store(pk, tuple(ingredient_ids))
+        self._version = version
+        self._deletions = deletions
+        self._synced_at = started
+
+    def match(self, ingredient_ids, min_coverage, limit):
+        """Список (id рецепта, есть ингредиентов, всего ингредиентов):
+        сначала рецепты с большей долей имеющихся ингредиентов."""
+        with self._lock:
+            self._sync()
+            found = Counter()
+            for ingredient_id in ingredient_ids:
+                found.update(self._postings.get(ingredient_id, ()))
+            matches = [
+                (pk, count, len(self._recipes[pk]))
+                for pk, count in found.items()
+                if count >= min_coverage * len(self._recipes[pk])
+            ]
+        matches.sort(key=lambda match: (
+            -match[1] / match[2], match[2] - match[1], -match[0]))
+        return matches[:limit]
+
+
+recipe_matcher = RecipeIngredientMatcher()
@@ -1,9 +1,14 @@
+from django.conf import settings
+from django.db import transaction
 from djoser.serializers import UserSerializer
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
+from api.cache import reference_cache
+from api.images import (RecipeImageField, delete_renditions, rendition_paths,
+                        renditions_urls, schedule_renditions)
+from api.utils import get_recipes_limit
 from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            Shoppinglist, Tag)
+                            ShoppingCartItem, Shoppinglist, Tag)
 from users.models import Subscriptions, User
 
 
@@ -17,6 +22,8 @@ class CustomUserSerializer(UserSerializer):
                   'last_name', 'is_subscribed')
 
     def get_is_subscribed(self, value):
+        if hasattr(value, 'subscribed'):
+            return value.subscribed
         if self.context.get('request').user.is_anonymous:
             return False
         return Subscriptions.objects.filter(user=self.context['request'].user,
@@ -43,10 +50,14 @@ class CustomUserSerializer(UserSerializer):
 class RecipeLookSerializer(serializers.ModelSerializer):
     """Сериализатор для представления рецепта при создании
        и получении подписки."""
+    renditions = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'renditions', 'cooking_time')
+
+    def get_renditions(self, value):
+        return renditions_urls(value, self.context.get('request'))
 
 
 class SubscriptionsGETSerializer(serializers.ModelSerializer):
@@ -66,35 +77,21 @@ class SubscriptionsGETSerializer(serializers.ModelSerializer):
                   'is_subscribed', 'recipes', 'recipes_count')
 
     def get_recipes(self, value):
-        recipes = Recipe.objects.filter(author=value.subscribing.id)
+        recipes = getattr(value.subscribing, 'limited_recipes', None)
+        if recipes is None:
+            recipes = Recipe.objects.filter(author=value.subscribing.id)
+            limit = get_recipes_limit(self.context.get('request'))
+            if limit:
+                recipes = recipes[:limit]
         return RecipeLookSerializer(recipes, many=True).data
 
     def get_recipes_count(self, value):
+        if hasattr(value, 'recipes_count'):
+            return value.recipes_count
         return Recipe.objects.filter(author=value.subscribing.id).count()
 
     def get_is_subscribed(self, value):
-        return Subscriptions.objects.filter(
-            user=value.user.id, subscribing=value.subscribing.id).exists()
-
-
-class SubscriptionsSerializer(serializers.ModelSerializer):
-    """Сериализатор для создания подписки пользователя."""
-
-    class Meta:
-        fields = ('user', 'subscribing')
-        model = Subscriptions
-
-    def to_representation(self, user):
-        return SubscriptionsGETSerializer(
-            user,
-            context={'request': self.context.get('request')},
-        ).data
-
-    def validate(self, data):
-        if self.context['request'].user == data['subscribing']:
-            raise serializers.ValidationError(
-                'Нельзя подписаться на себя.')
-        return data
+        return True
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -113,6 +110,21 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'color', 'slug')
 
 
+def get_tags_data():
+    """Сериализованные теги из кэша справочников: {id: данные}."""
+    return reference_cache.get_or_set('tag', 'all', lambda: {
+        tag['id']: tag
+        for tag in TagSerializer(Tag.objects.all(), many=True).data
+    })
+
+
+def get_ingredient_data(ingredient):
+    """Сериализованный ингредиент из кэша справочников."""
+    return reference_cache.get_or_set(
+        'ingredient', ingredient.id,
+        lambda: IngredientSerializer(ingredient).data)
+
+
 class RecipeIngredientSerializer(serializers.ModelSerializer):
     """Дополнительный сериализатор для представления ингредиента в рецепте."""
     id = serializers.ReadOnlyField(source='ingredients.id')
@@ -124,38 +136,82 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         model = RecipeIngredient
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
+    def to_representation(self, instance):
+        data = dict(get_ingredient_data(instance.ingredients))
+        data['amount'] = instance.amount
+        return data
+
 
 class RecipeGETSerializer(serializers.ModelSerializer):
     """Сериализатор при GET запросах модели Recipe."""
-    tags = TagSerializer(many=True)
+    tags = serializers.SerializerMethodField()
     author = CustomUserSerializer(read_only=True)
     ingredients = RecipeIngredientSerializer(
         many=True, source='recipe_ingredients')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
+    renditions = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart', 'name',
-                  'image', 'text', 'cooking_time')
+                  'image', 'renditions', 'text', 'cooking_time')
+
+    def get_renditions(self, value):
+        return renditions_urls(value, self.context.get('request'))
+
+    def get_tags(self, value):
+        tags = get_tags_data()
+        return [tags.get(tag.id) or TagSerializer(tag).data
+                for tag in value.tags.all()]
 
     def get_is_favorited(self, value):
+        if hasattr(value, 'is_favorited'):
+            return value.is_favorited
         if self.context.get('request').user.is_anonymous:
             return False
         return Favorite.objects.filter(user=self.context['request'].user,
                                        recipe=value).exists()
 
     def get_is_in_shopping_cart(self, value):
+        if hasattr(value, 'is_in_shopping_cart'):
+            return value.is_in_shopping_cart
         if self.context.get('request').user.is_anonymous:
             return False
         return Shoppinglist.objects.filter(user=self.context['request'].user,
                                            recipe=value).exists()
 
 
+class ShoppingCartItemSerializer(serializers.Serializer):
+    """Строка списка покупок в основных единицах."""
+    name = serializers.CharField()
+    amount = serializers.DecimalField(
+        max_digits=16, decimal_places=4, coerce_to_string=False)
+    measurement_unit = serializers.CharField()
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетных операций."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BATCH_RECIPES_LIMIT)
+
+
+class RecipeMatchSerializer(RecipeGETSerializer):
+    """Рецепт, подобранный по имеющимся ингредиентам."""
+    matched_ingredients = serializers.IntegerField(read_only=True)
+    missing_ingredients = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeGETSerializer.Meta):
+        fields = RecipeGETSerializer.Meta.fields + (
+            'matched_ingredients', 'missing_ingredients')
+
+
 class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
     """Дополнительный сериализатор для ингредиента при создании рецепта."""
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.IntegerField()
 
     class Meta:
@@ -172,10 +228,9 @@ class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
 
 class CreateRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для создания и изменения рецепта."""
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True)
+    tags = serializers.ListField(child=serializers.IntegerField())
     ingredients = RecipeIngredientCreateSerializer(many=True)
-    image = Base64ImageField()
+    image = RecipeImageField()
     cooking_time = serializers.IntegerField()
     name = serializers.RegexField(
         regex=r'^[а-яА-Яa-zA-Z0-9]+$',
@@ -189,32 +244,79 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
                   'text', 'cooking_time')
 
     def add_ingredient(self, recipes, ingredients):
-        for ingredient in ingredients:
-            ingredient_id = ingredient['id']
-            amount = ingredient['amount']
-            RecipeIngredient.objects.update_or_create(
-                ingredients=ingredient_id, recipes=recipes, amount=amount)
-
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipes=recipes,
+                             ingredients=ingredient['id'],
+                             amount=ingredient['amount'])
+            for ingredient in ingredients
+        )
+
+    def update_ingredient(self, recipes, ingredients):
+        """Обновляет ингредиенты и возвращает изменения количеств."""
+        existing = {recipe_ingredient.ingredients_id: recipe_ingredient
+                    for recipe_ingredient in recipes.recipe_ingredients.all()}
+        new = {ingredient['id'].id: ingredient for ingredient in ingredients}
+        deltas = {ingredient_id: -(recipe_ingredient.amount or 0)
+                  for ingredient_id, recipe_ingredient in existing.items()}
+        for ingredient_id, ingredient in new.items():
+            deltas[ingredient_id] = (deltas.get(ingredient_id, 0)
+                                     + ingredient['amount'])
+        removed = existing.keys() - new.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipes=recipes, ingredients__in=removed).delete()
+        changed = []
+        for ingredient_id, recipe_ingredient in existing.items():
+            if (ingredient_id in new and recipe_ingredient.amount
+                    != new[ingredient_id]['amount']):
+                recipe_ingredient.amount = new[ingredient_id]['amount']
+                changed.append(recipe_ingredient)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        self.add_ingredient(recipes, (
+            ingredient for ingredient_id, ingredient in new.items()
+            if ingredient_id not in existing))
+        return deltas
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tag = validated_data.pop('tags')
-        recipes = Recipe.objects.create(**validated_data)
+        recipes = Recipe.objects.create(
+            ingredient_ids=sorted(
+                ingredient['id'].id for ingredient in ingredients),
+            **validated_data)
         self.add_ingredient(recipes, ingredients)
         recipes.tags.set(tag)
+        Recipe.objects.filter(pk=recipes.pk).update_search_vector()
+        transaction.on_commit(lambda: schedule_renditions(recipes))
         return recipes
 
+    @transaction.atomic
     def update(self, recipes, validated_data):
         ingredients = validated_data.pop('ingredients')
         tag = validated_data.pop('tags')
-        recipes.ingredients.clear()
-        self.add_ingredient(recipes, ingredients)
+        ShoppingCartItem.objects.apply(
+            Shoppinglist.objects.filter(recipe=recipes).values_list(
+                'user_id', flat=True),
+            self.update_ingredient(recipes, ingredients))
+        recipes.ingredient_ids = sorted(
+            ingredient['id'].id for ingredient in ingredients)
         recipes.tags.set(tag)
-        return super().update(recipes, validated_data)
+        if 'image' in validated_data:
+            stale = rendition_paths(recipes.image_renditions)
+            recipes.image_renditions = {}
+            transaction.on_commit(lambda: delete_renditions(stale))
+            transaction.on_commit(lambda: schedule_renditions(recipes))
+        recipes = super().update(recipes, validated_data)
+        Recipe.objects.filter(pk=recipes.pk).update_search_vector()
+        return recipes
 
     def to_representation(self, recipe):
+        request = self.context.get('request')
         return RecipeGETSerializer(
-            recipe,
-            context={'request': self.context.get('request')},
+            Recipe.objects.for_user(request.user).get(pk=recipe.pk),
+            context={'request': request},
         ).data
 
     def validate_cooking_time(self, value):
@@ -234,6 +336,12 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
                     'Ингредиент может быть выбран только один раз.')
             else:
                 list.append(ingredient['id'])
+        found = Ingredient.objects.in_bulk(list)
+        for ingredient in data:
+            if ingredient['id'] not in found:
+                raise serializers.ValidationError(
+                    f'Ингредиента с id {ingredient["id"]} не существует.')
+            ingredient['id'] = found[ingredient['id']]
         return data
 
     def validate_tags(self, data):
@@ -247,7 +355,12 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
                     'Тег может быть выбран только один раз.')
             else:
                 list.append(tag)
-        return data
+        found = Tag.objects.in_bulk(list)
+        for tag in list:
+            if tag not in found:
+                raise serializers.ValidationError(
+                    f'Тега с id {tag} не существует.')
+        return [found[tag] for tag in list]
 
     def validate_name(self, value):
         if value.isdigit():
@@ -270,14 +383,6 @@ class FavoriteSerializer(serializers.ModelSerializer):
             context={'request': self.context.get('request')},
         ).data
 
-    def validate(self, data):
-        user = self.context['request'].user
-        if Favorite.objects.filter(user=user,
-                                   recipe=data['recipe']).exists():
-            raise serializers.ValidationError(
-                'Рецепт уже добавлен в избранное')
-        return data
-
 
 class ShoppinglistSerializer(serializers.ModelSerializer):
     """Сериализатор списка покупок."""
@@ -291,11 +396,3 @@ class ShoppinglistSerializer(serializers.ModelSerializer):
             recipe.recipe,
             context={'request': self.context.get('request')},
         ).data
-
-    def validate(self, data):
-        user = self.context['request'].user
-        if Shoppinglist.objects.filter(user=user,
-                                       recipe=data['recipe']).exists():
-            raise serializers.ValidationError(
-                'Рецепт уже добавлен в список покупок')
-        return data
@@ -0,0 +1,257 @@
+import base64
+import io
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.test import override_settings
+from django.urls import reverse
+from PIL import Image
+from rest_framework.test import APITestCase
+
+from api.authentication import TokenCache
+from api.cache import cart_cache, reference_cache, response_cache
+from api.images import build_renditions
+from recipes.models import (Ingredient, MeasurementUnit, Recipe,
+                            RecipeIngredient, ShoppingCartItem, Tag)
+from users.models import User
+
+CREATE_QUERIES = 14
+UPDATE_QUERIES = 21
+
+
+def make_png():
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), 'red').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def make_image():
+    return 'data:image/png;base64,' + base64.b64encode(make_png()).decode()
+
+
+class TempStorageTestCase(APITestCase):
+    """Файлы и общий кэш во временном каталоге."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+        cls.settings_override = override_settings(
+            MEDIA_ROOT=cls.temp_dir,
+            CACHES={'default': {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': cls.temp_dir + '/cache',
+            }})
+        cls.settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings_override.disable()
+        shutil.rmtree(cls.temp_dir, ignore_errors=True)
+
+    def clear_caches(self):
+        caches['default'].clear()
+        for cache in (reference_cache, response_cache, cart_cache):
+            cache.clear()
+
+
+class RecipeWriteQueriesTest(TempStorageTestCase):
+    """Число запросов при создании и изменении рецепта не зависит от
+    числа ингредиентов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {index}', color='#000000', slug=f'tag{index}')
+            for index in range(2)]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(40))
+        cls.ingredients = list(Ingredient.objects.order_by('pk'))
+        cls.image = make_image()
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def payload(self, ingredients, amount=10):
+        return {
+            'ingredients': [{'id': ingredient.pk, 'amount': amount}
+                            for ingredient in ingredients],
+            'tags': [tag.pk for tag in self.tags],
+            'image': self.image,
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+        }
+
+    def test_create_queries(self):
+        for size in (2, 20):
+            with self.subTest(ingredients=size):
+                self.clear_caches()
+                with self.assertNumQueries(CREATE_QUERIES):
+                    response = self.client.post(
+                        reverse('api:recipe-list'),
+                        self.payload(self.ingredients[:size]),
+                        format='json')
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(
+                    len(response.data['ingredients']), size)
+
+    def test_update_queries(self):
+        for size in (2, 20):
+            with self.subTest(ingredients=size):
+                recipe = Recipe.objects.create(
+                    author=self.user, name='Рецепт', text='Описание',
+                    cooking_time=10,
+                    ingredient_ids=[ingredient.pk for ingredient
+                                    in self.ingredients[:size]])
+                RecipeIngredient.objects.bulk_create(
+                    RecipeIngredient(recipes=recipe, ingredients=ingredient,
+                                     amount=10)
+                    for ingredient in self.ingredients[:size])
+                recipe.tags.set(self.tags[:1])
+                # Половина ингредиентов меняет количество, половина
+                # удаляется и столько же добавляется.
+                kept = self.ingredients[:size // 2]
+                added = self.ingredients[size:size + size // 2]
+                payload = self.payload(kept + added, amount=20)
+                del payload['image']
+                self.clear_caches()
+                with self.assertNumQueries(UPDATE_QUERIES):
+                    response = self.client.patch(
+                        reverse('api:recipe-detail', args=[recipe.pk]),
+                        payload, format='json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    sorted(item.ingredients_id for item
+                           in recipe.recipe_ingredients.all()),
+                    [ingredient.pk for ingredient in kept + added])
+
+
+class ResponseCacheLinksTest(TempStorageTestCase):
+    """Кэшированный ответ не содержит параметров вне ключа кэша."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'Рецепт {index}', text='Описание',
+                   cooking_time=10)
+            for index in range(3))
+
+    def setUp(self):
+        self.clear_caches()
+
+    @override_settings(RESPONSE_CACHE=True)
+    def test_unknown_params_not_in_links(self):
+        url = reverse('api:recipe-list')
+        planted = self.client.get(url, {'evil': 'x', 'limit': 1})
+        self.assertNotIn('evil', planted.json()['next'])
+        response = self.client.get(url, {'limit': 1})
+        self.assertEqual(response.content, planted.content)
+        self.assertNotIn('evil', response.json()['next'])
+
+
+@override_settings(AUTH_TOKEN_CACHE_SHARED=True)
+class SharedTokenCacheTest(TempStorageTestCase):
+    """Выход в одном процессе сразу виден другим."""
+
+    def test_logout_seen_by_other_process(self):
+        user = User.objects.create_user(
+            username='user', email='user@example.com', password='pass')
+        worker, other = TokenCache(10), TokenCache(10)
+        worker.set('token', user)
+        self.assertEqual(other.get('token'), user)
+        worker.delete('token')
+        self.assertIsNone(other.get('token'))
+
+
+class RenditionFilesTest(TempStorageTestCase):
+    """Уменьшенные копии не остаются на диске без рецепта."""
+
+    def setUp(self):
+        shutil.rmtree(os.path.join(self.temp_dir, 'recipe'),
+                      ignore_errors=True)
+        self.user = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Рецепт', text='Описание',
+            cooking_time=10)
+        self.recipe.image.save('photo.png', ContentFile(make_png()))
+
+    def rendition_files(self):
+        directory = os.path.join(
+            self.temp_dir, settings.IMAGE_RENDITIONS_DIR)
+        if not os.path.isdir(directory):
+            return set()
+        return set(os.listdir(directory))
+
+    def build(self):
+        build_renditions(self.recipe.pk, self.recipe.image.name)
+        self.recipe.refresh_from_db()
+
+    def test_rebuild_reuses_files(self):
+        self.build()
+        files = self.rendition_files()
+        self.assertTrue(files)
+        self.build()
+        self.assertEqual(self.rendition_files(), files)
+
+    def test_recipe_delete(self):
+        self.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.delete()
+        self.assertEqual(self.rendition_files(), set())
+
+    @mock.patch('api.serializers.schedule_renditions')
+    def test_image_replaced(self, schedule_renditions):
+        ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г')
+        tag = Tag.objects.create(
+            name='Завтрак', color='#000000', slug='breakfast')
+        self.build()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                reverse('api:recipe-detail', args=[self.recipe.pk]),
+                {'ingredients': [{'id': ingredient.pk, 'amount': 10}],
+                 'tags': [tag.pk], 'image': make_image(), 'name': 'Рецепт',
+                 'text': 'Описание', 'cooking_time': 10},
+                format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.rendition_files(), set())
+        schedule_renditions.assert_called_once()
+
+
+class CartTotalsCacheTest(TempStorageTestCase):
+    """Итоги списка покупок учитывают изменение единиц измерения."""
+
+    @override_settings(REFERENCE_CACHE_VERSION_TTL=0)
+    def test_unit_factor_change(self):
+        user = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='pass')
+        gram, _ = MeasurementUnit.objects.get_or_create(key='г', name='г')
+        spoon = MeasurementUnit.objects.create(
+            name='мерка', base=gram, factor=10)
+        salt = Ingredient.objects.create(
+            name='соль', measurement_unit='мерка', unit=spoon)
+        ShoppingCartItem.objects.create(user=user, ingredient=salt, amount=2)
+        self.clear_caches()
+        self.client.force_authenticate(user)
+        url = reverse('api:recipe-cart')
+        self.assertEqual(self.client.get(url).json()[0]['amount'], 20)
+        spoon.factor = 15
+        with self.captureOnCommitCallbacks(execute=True):
+            spoon.save()
+        self.assertEqual(self.client.get(url).json()[0]['amount'], 30)
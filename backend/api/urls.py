@@ -1,11 +1,19 @@
-from django.urls import include, path
+from django.conf import settings
+from django.urls import include, path, re_path
 from rest_framework.routers import DefaultRouter
 
+from api.utils import async_view
 from api.views import (CustomUserViewSet, IngredientViewSet,
-                       RecipeViewSet, SubcriptionsList, TagViewSet)
+                       RecipeViewSet, RequestStatsView, SubcriptionsList,
+                       TagViewSet)
 
 app_name = 'api'
 
+ASYNC_ROUTES = (
+    'recipe-list', 'recipe-detail', 'recipe-cook', 'tag-list', 'tag-detail',
+    'ingredient-list', 'ingredient-detail', 'users/subscriptions-list',
+)
+
 router = DefaultRouter()
 router.register('tags', TagViewSet)
 router.register('recipes', RecipeViewSet)
@@ -14,8 +22,18 @@ router.register('users/subscriptions', SubcriptionsList,
                 basename='users/subscriptions')
 router.register('users', CustomUserViewSet)
 
+router_urls = router.urls
+if settings.ASYNC_API:
+    router_urls = [
+        re_path(url.pattern.regex.pattern, async_view(url.callback),
+                name=url.name)
+        if url.name in ASYNC_ROUTES else url
+        for url in router_urls
+    ]
+
 urlpatterns = [
-    path('', include(router.urls)),
+    path('', include(router_urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
+    path('stats/', RequestStatsView.as_view(), name='stats'),
 ]
@@ -1,13 +1,146 @@
-from django.http import HttpResponse
+import csv
+import io
+from functools import wraps
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
 
-def download(ingredients_list):
-    new_list = 'Список покупок: \n'
+PDF_LINE_HEIGHT = 20
+PDF_MARGIN = 50
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def format_amount(amount):
+    """1200.0000 -> 1200, 0.5000 -> 0.5."""
+    return f'{amount.normalize():f}' if amount is not None else ''
+
+
+def render_txt(ingredients_list):
+    yield 'Список покупок: \n'
     for ingredient in ingredients_list:
-        new_list += (f'{ingredient["ingredients__name"]} - '
-                     f'{ingredient["amount"]} '
-                     f'{ingredient["ingredients__measurement_unit"]} \n')
-    response = HttpResponse(new_list, 'Content-Type: text/plain')
+        yield (f'{ingredient["name"]} - '
+               f'{format_amount(ingredient["amount"])} '
+               f'{ingredient["measurement_unit"]} \n')
+
+
+def render_csv(ingredients_list):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('Ингредиент', 'Количество', 'Единицы измерения'))
+    for ingredient in ingredients_list:
+        yield writer.writerow((ingredient['name'],
+                               format_amount(ingredient['amount']),
+                               ingredient['measurement_unit']))
+
+
+def render_pdf(ingredients_list):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFError, TTFont
+    from reportlab.pdfgen import canvas
+
+    font = 'Helvetica'
+    try:
+        pdfmetrics.registerFont(
+            TTFont('ShoppingCartFont', settings.SHOPPING_CART_PDF_FONT))
+        font = 'ShoppingCartFont'
+    except TTFError:
+        pass
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    y = height - PDF_MARGIN
+    for line in render_txt(ingredients_list):
+        if y < PDF_MARGIN:
+            pdf.showPage()
+            y = height - PDF_MARGIN
+        pdf.setFont(font, 12)
+        pdf.drawString(PDF_MARGIN, y, line.strip())
+        y -= PDF_LINE_HEIGHT
+    pdf.save()
+    buffer.seek(0)
+    yield from iter(lambda: buffer.read(8192), b'')
+
+
+RENDERERS = {
+    'txt': (render_txt, 'text/plain; charset=utf-8'),
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'pdf': (render_pdf, 'application/pdf'),
+}
+
+
+def download(ingredients_list, file_format='txt'):
+    renderer, content_type = RENDERERS[file_format]
+    response = StreamingHttpResponse(renderer(ingredients_list),
+                                     content_type=content_type)
     response['Content-Disposition'] = ('attachment; '
-                                       'filename="buylist.txt"')
+                                       f'filename="buylist.{file_format}"')
     return response
+
+
+def get_recipes_limit(request):
+    """Значение recipes_limit из запроса или None."""
+    if request is None:
+        return None
+    try:
+        limit = int(request.query_params.get('recipes_limit'))
+    except (TypeError, ValueError):
+        return None
+    return limit if limit > 0 else None
+
+
+def get_ingredient_ids(request):
+    """Id ингредиентов из параметров ingredients=1,2&ingredients=3."""
+    values = ','.join(request.query_params.getlist('ingredients'))
+    ids = [value.strip() for value in values.split(',') if value.strip()]
+    if not ids or not all(value.isdigit() for value in ids):
+        raise ValidationError({'ingredients': [
+            'Передайте id ингредиентов через запятую.']})
+    return {int(value) for value in ids}
+
+
+def get_min_coverage(request):
+    """Минимальная доля имеющихся ингредиентов рецепта, от 0 до 1."""
+    try:
+        coverage = float(request.query_params.get('min_coverage', 0))
+    except ValueError:
+        coverage = -1
+    if not 0 <= coverage <= 1:
+        raise ValidationError({'min_coverage': [
+            'Укажите число от 0 до 1.']})
+    return coverage
+
+
+def async_view(view):
+    """Асинхронная обёртка над синхронным представлением.
+
+    Под ASGI Django выполняет синхронные представления по очереди в
+    одном потоке. Безопасные запросы здесь уходят в общий пул потоков,
+    поэтому ожидание базы данных разных запросов перекрывается.
+    """
+    def run(request, *args, **kwargs):
+        close_old_connections()
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            close_old_connections()
+
+    parallel = sync_to_async(run, thread_sensitive=False)
+    serial = sync_to_async(view)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return await parallel(request, *args, **kwargs)
+        return await serial(request, *args, **kwargs)
+
+    return wrapper
@@ -1,27 +1,47 @@
-from django.db.models import Sum
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.http import Http404, HttpResponse, QueryDict
 from django.shortcuts import get_object_or_404
+from django.utils.http import urlencode
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.permissions import (AllowAny, IsAuthenticated,
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import (SAFE_METHODS, AllowAny,
+                                        IsAdminUser, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from api.cache import (bump_version, cart_cache, get_state,
+                       reference_cache, response_cache)
 from api.filters import IngregientFilter, RecipeFilter
-from api.mixins import ListRetrieveViewSet
+from api.middleware import route_stats
+from api.mixins import ConditionalGetMixin, ListRetrieveViewSet
 from api.pagination import Pagination
 from api.permissions import AuthorOrReadOnly
 from api.serializers import (CreateRecipeSerializer, CustomUserSerializer,
                              FavoriteSerializer, IngredientSerializer,
-                             RecipeGETSerializer, ShoppinglistSerializer,
-                             SubscriptionsGETSerializer,
-                             SubscriptionsSerializer, TagSerializer)
-from api.utils import download
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                             RecipeGETSerializer, RecipeIdsSerializer,
+                             RecipeLookSerializer, RecipeMatchSerializer,
+                             ShoppingCartItemSerializer,
+                             ShoppinglistSerializer,
+                             SubscriptionsGETSerializer, TagSerializer,
+                             get_ingredient_data, get_tags_data)
+from api.search import recipe_matcher
+from api.utils import (RENDERERS, download, get_ingredient_ids,
+                       get_min_coverage, get_recipes_limit)
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCartItem,
                             Shoppinglist, Tag)
 from users.models import Subscriptions, User
 
+ALREADY_ADDED = {
+    Favorite: 'Рецепт уже добавлен в избранное',
+    Shoppinglist: 'Рецепт уже добавлен в список покупок',
+}
+
 
 class CustomUserViewSet(UserViewSet):
     """Преобразование функции djoser для получения пользователя"""
@@ -36,30 +56,32 @@ class CustomUserViewSet(UserViewSet):
         if self.request.method == 'GET':
             return User.objects.all()
 
-    @action(detail=True, methods=['post', 'delete'], url_path='subscribe')
+    @action(detail=True, methods=['post', 'delete'], url_path='subscribe',
+            permission_classes=[IsAuthenticated])
     def subscribe(self, request, id=None):
         user = request.user
-        subscribing = get_object_or_404(User, id=id)
         if self.request.method == 'POST':
-            data = {
-                'user': user.id,
-                'subscribing': subscribing.id
-            }
-            serializer = SubscriptionsSerializer(
-                data=data, context={'request': request})
-            if serializer.is_valid():
-                serializer.save()
-                return Response(serializer.data,
-                                status=status.HTTP_201_CREATED)
-            return Response(serializer.errors,
-                            status=status.HTTP_400_BAD_REQUEST)
-        if self.request.method == 'DELETE':
-            subscription = Subscriptions.objects.filter(
-                user=user, subscribing=subscribing)
-            if subscription.exists():
-                subscription.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            return Response(status=status.HTTP_400_BAD_REQUEST)
+            subscribing = get_object_or_404(User, id=id)
+            if user == subscribing:
+                return Response(
+                    {'non_field_errors': ['Нельзя подписаться на себя.']},
+                    status=status.HTTP_400_BAD_REQUEST)
+            if not Subscriptions.objects.insert_ignore(
+                    user_id=user.id, subscribing_id=subscribing.id):
+                return Response(
+                    {'non_field_errors': ['Вы уже подписаны на автора.']},
+                    status=status.HTTP_400_BAD_REQUEST)
+            transaction.on_commit(lambda: bump_version(f'user:{user.id}'))
+            return Response(SubscriptionsGETSerializer(
+                Subscriptions(user=user, subscribing=subscribing),
+                context={'request': request}).data,
+                status=status.HTTP_201_CREATED)
+        if Subscriptions.objects.delete_link(
+                user_id=user.id, subscribing_id=id):
+            transaction.on_commit(lambda: bump_version(f'user:{user.id}'))
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        get_object_or_404(User, id=id)
+        return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
 class SubcriptionsList(mixins.ListModelMixin,
@@ -68,29 +90,73 @@ class SubcriptionsList(mixins.ListModelMixin,
     serializer_class = SubscriptionsGETSerializer
     permission_classes = (IsAuthenticated,)
     pagination_class = Pagination
+    cursor_ordering = ('-id',)
 
     def get_queryset(self):
-        return Subscriptions.objects.filter(user=self.request.user.id)
+        recipes = Recipe.objects.order_by('-pub_date')
+        limit = get_recipes_limit(self.request)
+        if limit:
+            recipes = recipes.filter(id__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).order_by('-pub_date').values('id')[:limit]
+            ))
+        return Subscriptions.objects.filter(
+            user=self.request.user.id
+        ).select_related('subscribing').annotate(
+            recipes_count=Count('subscribing__recipes')
+        ).order_by('id').prefetch_related(
+            Prefetch('subscribing__recipes', queryset=recipes,
+                     to_attr='limited_recipes')
+        )
 
 
-class IngredientViewSet(ListRetrieveViewSet):
+class IngredientViewSet(ConditionalGetMixin, ListRetrieveViewSet):
     """Получение списка или конкретного ингредиента."""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngregientFilter
-    search_fields = ('^name',)
+    cache_state = ('ingredient',)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action == 'list' and self.request.query_params.get('name'):
+            return queryset[:settings.INGREDIENT_SEARCH_LIMIT]
+        return queryset
 
+    def list(self, request, *args, **kwargs):
+        return Response(reference_cache.get_or_set(
+            'ingredient',
+            ('list', request.query_params.get('name', '').lower()),
+            lambda: super(IngredientViewSet, self).list(
+                request, *args, **kwargs).data
+        ))
 
-class TagViewSet(ListRetrieveViewSet):
+    def retrieve(self, request, *args, **kwargs):
+        return Response(get_ingredient_data(self.get_object()))
+
+
+class TagViewSet(ConditionalGetMixin, ListRetrieveViewSet):
     """Получение списка или конкретного тега."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
+    cache_state = ('tag',)
+
+    def list(self, request, *args, **kwargs):
+        return Response(list(get_tags_data().values()))
+
+    def retrieve(self, request, *args, **kwargs):
+        tag_id = self.kwargs['pk']
+        tag = get_tags_data().get(int(tag_id)) if tag_id.isdigit() else None
+        if tag is None:
+            raise Http404
+        return Response(tag)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """Обрабатывает запросы о рецептах."""
 
     queryset = Recipe.objects.all()
@@ -99,14 +165,102 @@ class RecipeViewSet(viewsets.ModelViewSet):
     pagination_class = Pagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
-    search_fields = ('^name',)
+    cache_state = ('recipe', 'tag', 'ingredient')
+    # Параметры, от которых зависит ответ анонимному пользователю,
+    # остальные не попадают в ключ кэша ответов.
+    response_cache_params = (
+        'tags', 'author', 'is_favorited', 'is_in_shopping_cart', 'search',
+        'ordering', 'page', 'limit', 'cursor',
+    )
+    orderings = {
+        'newest': ('-pub_date', '-id'),
+        'popular': ('-favorites_count', '-pub_date', '-id'),
+        'fastest': ('cooking_time', '-pub_date', '-id'),
+    }
+
+    def get_ordering(self):
+        params = self.request.query_params
+        if 'ordering' not in params and params.get('search', '').strip():
+            return ('-search_rank', '-pub_date', '-id')
+        ordering = params.get('ordering', 'newest')
+        if ordering not in self.orderings:
+            raise ValidationError({'ordering': [
+                f'Доступные значения: {", ".join(self.orderings)}']})
+        return self.orderings[ordering]
+
+    @property
+    def cursor_ordering(self):
+        return self.get_ordering()
+
+    def get_cache_state(self):
+        if self.action == 'retrieve':
+            cache_state = ('tag', 'ingredient', 'author',
+                           f'recipe:{self.kwargs["pk"]}')
+        else:
+            cache_state = self.cache_state
+            if self.get_ordering() == self.orderings['popular']:
+                cache_state += ('popularity',)
+        if self.request.user.is_anonymous:
+            return cache_state
+        return cache_state + (f'user:{self.request.user.id}',)
+
+    def get_queryset(self):
+        return Recipe.objects.for_user(self.request.user)
+
+    def get_response_cache_params(self, request):
+        params = []
+        for name in self.response_cache_params:
+            values = request.query_params.getlist(name)
+            if name == 'tags':
+                values = sorted({value.lower() for value in values})
+            if values:
+                params.append((name, tuple(values)))
+        return tuple(params)
+
+    def get_response_cache_key(self, request):
+        return (self.action, request.scheme, request.get_host(),
+                self.kwargs.get('pk'), self.get_response_cache_params(request),
+                self.cache_versions)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        """Отрисованный JSON ответ анонимному пользователю из кэша."""
+        if not (settings.RESPONSE_CACHE and request.user.is_anonymous
+                and request.accepted_media_type == 'application/json'):
+            return handler(request, *args, **kwargs)
+        # Ссылки пагинации строятся из запроса, поэтому в нём остаются
+        # только параметры ключа кэша.
+        query = urlencode([
+            (name, value)
+            for name, values in self.get_response_cache_params(request)
+            for value in values])
+        request._request.GET = QueryDict(query)
+        request._request.META['QUERY_STRING'] = query
+        content = response_cache.get_or_set(
+            self.get_response_cache_key(request),
+            lambda: request.accepted_renderer.render(
+                handler(request, *args, **kwargs).data,
+                request.accepted_media_type, self.get_renderer_context()))
+        return HttpResponse(content, content_type=request.accepted_media_type)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        return super().filter_queryset(queryset).order_by(
+            *self.get_ordering())
 
     def get_serializer_class(self):
-        if self.request.method == 'PATCH' or 'POST':
-            return CreateRecipeSerializer
-        return RecipeGETSerializer
+        if self.request.method in SAFE_METHODS:
+            return RecipeGETSerializer
+        return CreateRecipeSerializer
 
     def get_permissions(self):
+        if self.action in ('cart', 'download_shopping_cart'):
+            return super().get_permissions()
         if self.request.method == 'GET':
             return (IsAuthenticatedOrReadOnly(),)
         if self.request.method == 'PATCH':
@@ -118,27 +272,57 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     def creation_and_deletion(self, request, models, pk):
         user = request.user.id
-        recipe = get_object_or_404(Recipe, id=pk).id
         if self.request.method == 'POST':
-            data = {
-                'user': user,
-                'recipe': recipe
-            }
-            serializer = self.serializer_class(
-                data=data, context={'request': request})
-            if serializer.is_valid():
-                serializer.save()
-                return Response(serializer.data,
-                                status=status.HTTP_201_CREATED)
-            return Response(serializer.errors,
-                            status=status.HTTP_400_BAD_REQUEST)
-        if self.request.method == 'DELETE':
-            shopping_list = models.objects.filter(
-                user=user, recipe=recipe)
-            if shopping_list.exists():
-                shopping_list.delete()
+            recipe = get_object_or_404(Recipe, id=pk)
+            with transaction.atomic():
+                if not models.objects.insert_ignore(
+                        user_id=user, recipe_id=recipe.id):
+                    return Response(
+                        {'non_field_errors': [ALREADY_ADDED[models]]},
+                        status=status.HTTP_400_BAD_REQUEST)
+                self.link_changed(models, [recipe.id], user, 1)
+            return Response(RecipeLookSerializer(
+                recipe, context={'request': request}).data,
+                status=status.HTTP_201_CREATED)
+        with transaction.atomic():
+            if models.objects.delete_link(user_id=user, recipe_id=pk):
+                self.link_changed(models, [pk], user, -1)
                 return Response(status=status.HTTP_204_NO_CONTENT)
-            return Response(status=status.HTTP_400_BAD_REQUEST)
+        get_object_or_404(Recipe, id=pk)
+        return Response(status=status.HTTP_400_BAD_REQUEST)
+
+    def link_changed(self, models, recipes, user, delta):
+        """Счётчики, список покупок и версии после изменения связей."""
+        Recipe.objects.filter(id__in=recipes).change_counter(models, delta)
+        if models is Shoppinglist:
+            ShoppingCartItem.objects.add_recipes(recipes, [user], sign=delta)
+        transaction.on_commit(lambda: bump_version('popularity'))
+        transaction.on_commit(lambda: bump_version(f'user:{user}'))
+
+    def batch_creation_and_deletion(self, request, models):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = set(serializer.validated_data['recipes'])
+        user = request.user
+        found = set(Recipe.objects.filter(id__in=ids).values_list(
+            'id', flat=True))
+        with transaction.atomic():
+            # Изменённые связи берутся из самих INSERT и DELETE, чтобы
+            # параллельные запросы не учли одну строку дважды.
+            if request.method == 'POST':
+                changed, delta = models.objects.insert_ignore_many(
+                    'recipe_id', found, user_id=user.id), 1
+            else:
+                changed, delta = models.objects.delete_links(
+                    'recipe_id', found, user_id=user.id), -1
+            skipped = found - changed
+            if changed:
+                self.link_changed(models, changed, user.id, delta)
+        return Response({
+            'added' if delta > 0 else 'removed': sorted(changed),
+            'skipped': sorted(skipped),
+            'not_found': sorted(ids - found),
+        })
 
     @action(detail=True, methods=['post', 'delete'], url_path='favorite',
             serializer_class=FavoriteSerializer)
@@ -146,19 +330,81 @@ class RecipeViewSet(viewsets.ModelViewSet):
         models = Favorite
         return self.creation_and_deletion(request, models, pk)
 
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='favorite/batch', url_name='favorite-batch')
+    def favorite_batch(self, request):
+        """Добавление или удаление нескольких рецептов в избранном."""
+        return self.batch_creation_and_deletion(request, Favorite)
+
     @action(detail=True, methods=['post', 'delete'], url_path='shopping_cart',
             serializer_class=ShoppinglistSerializer)
     def shopping_cart(self, request, pk=None):
         models = Shoppinglist
         return self.creation_and_deletion(request, models, pk)
 
+    @action(detail=False, methods=['get'], url_path='cook')
+    def cook(self, request):
+        """Рецепты, которые можно приготовить из переданных ингредиентов."""
+        matches = recipe_matcher.match(
+            get_ingredient_ids(request), get_min_coverage(request),
+            settings.RECIPE_MATCH_LIMIT)
+        page = self.paginate_queryset(matches)
+        recipes = self.get_queryset().in_bulk(
+            [pk for pk, _, _ in page])
+        result = []
+        for pk, matched, total in page:
+            if pk in recipes:
+                recipe = recipes[pk]
+                recipe.matched_ingredients = matched
+                recipe.missing_ingredients = total - matched
+                result.append(recipe)
+        serializer = RecipeMatchSerializer(
+            result, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='shopping_cart/batch', url_name='shopping-cart-batch')
+    def shopping_cart_batch(self, request):
+        """Добавление или удаление нескольких рецептов в списке покупок."""
+        return self.batch_creation_and_deletion(request, Shoppinglist)
+
+    def get_cart_totals(self, user):
+        # Версия пользователя читается без локальной задержки, чтобы
+        # список сразу учитывал только что добавленные рецепты.
+        return cart_cache.get_or_set(
+            f'user:{user.id}',
+            ('cart', get_state(f'user:{user.id}')[0],
+             cart_cache.get_version('recipe'),
+             cart_cache.get_version('ingredient')),
+            lambda: list(ShoppingCartItem.objects.totals(user)))
+
+    @action(detail=False, methods=['get'], url_path='shopping_cart',
+            url_name='cart', permission_classes=[IsAuthenticated])
+    def cart(self, request):
+        """Список покупок в JSON."""
+        return Response(ShoppingCartItemSerializer(
+            self.get_cart_totals(request.user), many=True).data)
+
     @action(detail=False, methods=['get'], url_path='download_shopping_cart',
             permission_classes=[IsAuthenticated])
     def download_shopping_cart(self, request):
-        ingredients_list = RecipeIngredient.objects.filter(
-            recipes__recipe_shoppinglist__user=request.user
-        ).values(
-            'ingredients__name',
-            'ingredients__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-        return download(ingredients_list)
+        file_format = request.query_params.get('type', 'txt')
+        if file_format not in RENDERERS:
+            return Response(
+                {'errors': 'Доступные форматы: '
+                           f'{", ".join(RENDERERS)}'},
+                status=status.HTTP_400_BAD_REQUEST)
+        return download(self.get_cart_totals(request.user), file_format)
+
+
+class RequestStatsView(APIView):
+    """Сводка RequestStatsMiddleware по маршрутам текущего процесса."""
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(route_stats.as_dict())
+
+    def delete(self, request):
+        route_stats.clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
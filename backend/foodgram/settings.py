@@ -1,5 +1,6 @@
 from pathlib import Path
 import os
+import tempfile
 from dotenv import load_dotenv
 
 
@@ -39,6 +40,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+if os.getenv('REQUEST_STATS', default='False').lower() == 'true':
+    MIDDLEWARE.insert(0, 'api.middleware.RequestStatsMiddleware')
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', 500))
+SLOW_REQUEST_QUERIES = int(os.getenv('SLOW_REQUEST_QUERIES', 30))
+
 ROOT_URLCONF = 'foodgram.urls'
 
 TEMPLATES = [
@@ -58,6 +64,9 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
+ASGI_APPLICATION = 'foodgram.asgi.application'
+
+ASYNC_API = os.getenv('ASYNC_API', default='False').lower() == 'true'
 
 
 DATABASES = {
@@ -93,7 +102,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ]
 }
 
@@ -115,6 +124,15 @@ STATIC_ROOT = BASE_DIR / 'static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+IMAGE_DECODE_WORKERS = int(os.getenv('IMAGE_DECODE_WORKERS', 2))
+IMAGE_RENDITIONS_DIR = 'recipe/renditions/'
+IMAGE_RENDITIONS = {
+    'thumbnail': (160, 160),
+    'card': (600, 400),
+    'detail': (1200, 800),
+}
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.User'
@@ -130,6 +148,58 @@ DJOSER = {
     },
 }
 
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'SHOPPING_CART_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+PAGE_SIZE = 6
+MAX_PAGE_SIZE = 100
+
+INGREDIENT_SEARCH_LIMIT = 50
+
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'russian')
+RECIPE_SEARCH_LIMIT = 500
+RECIPE_MATCH_LIMIT = 500
+BATCH_RECIPES_LIMIT = 100
+
+# Версии данных для кэшей и ETag должны быть общими для всех процессов
+# (воркеров и management команд), поэтому по умолчанию файловый кэш.
+# С LocMemCache и DummyCache версионированные кэши отключаются.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'foodgram_cache')
+        ),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+}
+
+REFERENCE_CACHE_ALIAS = 'default'
+REFERENCE_CACHE_SIZE = 4096
+REFERENCE_CACHE_VERSION_TTL = 1
+CART_CACHE_SIZE = 1024
+REFERENCE_CACHE_SHARED = os.getenv(
+    'REFERENCE_CACHE_SHARED', default='False').lower() == 'true'
+
+RESPONSE_CACHE = os.getenv(
+    'RESPONSE_CACHE', default='True').lower() == 'true'
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TIMEOUT = 600
+RESPONSE_CACHE_LOCK_TIMEOUT = 5
+RESPONSE_CACHE_SHARED = os.getenv(
+    'RESPONSE_CACHE_SHARED', default='False').lower() == 'true'
+
+AUTH_TOKEN_CACHE_SIZE = 10000
+AUTH_TOKEN_CACHE_TTL = int(os.getenv('AUTH_TOKEN_CACHE_TTL', 30))
+AUTH_TOKEN_CACHE_SHARED = os.getenv(
+    'AUTH_TOKEN_CACHE_SHARED', default='False').lower() == 'true'
+
 INT_200 = 200
 INT_150 = 150
 INT_254 = 254
@@ -1,19 +1,61 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
-from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            RecipeTag, Shoppinglist, Tag)
+from recipes.models import (Favorite, Ingredient, MeasurementUnit, Recipe,
+                            RecipeIngredient, RecipeTag, ShoppingCartItem,
+                            Shoppinglist, Tag)
+
+
+ESTIMATED_COUNT_THRESHOLD = 100000
+
+
+class EstimatedCountPaginator(Paginator):
+    """Для больших таблиц PostgreSQL без фильтров берёт оценку числа
+    строк из статистики планировщика вместо COUNT(*)."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s',
+                    [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > ESTIMATED_COUNT_THRESHOLD:
+                return int(row[0])
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Список без полного COUNT(*) и со связями одним запросом."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 class RecipeIngredientInline(admin.TabularInline):
     model = RecipeIngredient
     extra = 1
     min_num = 1
+    autocomplete_fields = ('ingredients',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'recipes', 'ingredients')
 
 
 class RecipeTagInline(admin.TabularInline):
     model = RecipeTag
     extra = 1
     min_num = 1
+    autocomplete_fields = ('tags',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'recipes', 'tags')
 
 
 @admin.register(Tag)
@@ -25,21 +67,44 @@ class TagAdmin(admin.ModelAdmin):
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'measurement_unit')
+    list_display = ('id', 'name', 'measurement_unit', 'unit')
+    list_select_related = ('unit',)
     search_fields = ('name',)
     list_filter = ('name',)
 
 
+@admin.register(MeasurementUnit)
+class MeasurementUnitAdmin(admin.ModelAdmin):
+    list_display = ('name', 'base', 'factor')
+    search_fields = ('name',)
+
+
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(LargeTableAdmin):
     list_display = ('id', 'name', 'author', 'text',
                     'is_favorited', 'ingredient_recipe')
-    search_fields = ('name',)
-    list_filter = ('name', 'author')
+    list_select_related = ('author',)
+    search_fields = ('name', 'author__username')
+    list_filter = ('tags',)
+    autocomplete_fields = ('author',)
     inlines = (RecipeIngredientInline, RecipeTagInline)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('ingredients')
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        recipes = Recipe.objects.filter(pk=form.instance.pk)
+        recipes.update(ingredient_ids=sorted(
+            form.instance.recipe_ingredients.values_list(
+                'ingredients_id', flat=True)))
+        recipes.update_search_vector()
+        ShoppingCartItem.objects.rebuild(
+            form.instance.recipe_shoppinglist.values_list(
+                'user_id', flat=True))
+
     def is_favorited(self, obj):
-        return obj.recipe_favorite.all().count()
+        return obj.favorites_count
 
     def ingredient_recipe(self, object):
         return ', '.join((
@@ -47,10 +112,27 @@ class RecipeAdmin(admin.ModelAdmin):
 
 
 @admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
+class FavoriteAdmin(LargeTableAdmin):
     list_display = ('user', 'recipe')
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
 
 
 @admin.register(Shoppinglist)
-class ShoppinglistAdmin(admin.ModelAdmin):
+class ShoppinglistAdmin(LargeTableAdmin):
     list_display = ('user', 'recipe')
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        ShoppingCartItem.objects.rebuild([obj.user_id])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        ShoppingCartItem.objects.rebuild([obj.user_id])
+
+    def delete_queryset(self, request, queryset):
+        users = set(queryset.values_list('user_id', flat=True))
+        super().delete_queryset(request, queryset)
+        ShoppingCartItem.objects.rebuild(users)
@@ -0,0 +1,149 @@
+import random
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from api.cache import bump_version
+from recipes.models import (Favorite, Ingredient, MeasurementUnit, Recipe,
+                            RecipeIngredient, RecipeTag, ShoppingCartItem,
+                            Shoppinglist, Tag)
+from users.models import Subscriptions, User
+
+BATCH_SIZE = 1000
+UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+
+
+class Command(BaseCommand):
+    """Синтетический набор данных для замеров производительности.
+
+    Ингредиенты берутся из базы (загрузите их import_data или
+    сгенерируйте --ingredients), недостающие теги создаются.
+    Повторный запуск добавляет данные.
+    """
+
+    help = 'Генерирует пользователей, рецепты, избранное и покупки.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--ingredients', type=int, default=0)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--favorites-per-user', type=int, default=30)
+        parser.add_argument('--carts-per-user', type=int, default=5)
+        parser.add_argument('--subscriptions-per-user', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def get_tags(self):
+        tags = list(Tag.objects.all())
+        if tags:
+            return tags
+        colors = ('#E26C2D', '#49B64E', '#8775D2')
+        for slug, color in zip(('breakfast', 'lunch', 'dinner'), colors):
+            tags.append(Tag.objects.create(
+                name=slug, slug=slug, color=color))
+        return tags
+
+    def create_ingredients(self, count, rng):
+        offset = Ingredient.objects.count()
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=f'ингредиент {offset + number}',
+                        measurement_unit=rng.choice(UNITS))
+             for number in range(count)],
+            batch_size=BATCH_SIZE, ignore_conflicts=True)
+        MeasurementUnit.objects.attach(Ingredient.objects.all())
+
+    def create_users(self, count, rng):
+        offset = User.objects.count()
+        password = make_password(None)
+        users = [
+            User(username=f'bench{offset + number}',
+                 email=f'bench{offset + number}@example.com',
+                 first_name='Bench', last_name=str(offset + number),
+                 password=password)
+            for number in range(count)
+        ]
+        User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+        return list(User.objects.filter(
+            username__in=[user.username for user in users]))
+
+    def create_recipes(self, count, authors, tags, ingredient_ids,
+                       per_recipe, rng):
+        per_recipe = min(per_recipe, len(ingredient_ids))
+        recipes = Recipe.objects.bulk_create(
+            [Recipe(author=rng.choice(authors),
+                    name=f'Рецепт {number}',
+                    text='Сгенерированный рецепт.',
+                    cooking_time=rng.randint(5, 240),
+                    ingredient_ids=sorted(
+                        rng.sample(ingredient_ids, per_recipe)))
+             for number in range(count)],
+            batch_size=BATCH_SIZE)
+        if not recipes or recipes[0].pk is None:
+            recipes = list(Recipe.objects.order_by('-id')[:count])
+        RecipeTag.objects.bulk_create(
+            [RecipeTag(recipes=recipe, tags=tag)
+             for recipe in recipes
+             for tag in rng.sample(tags, rng.randint(1, len(tags)))],
+            batch_size=BATCH_SIZE)
+        RecipeIngredient.objects.bulk_create(
+            [RecipeIngredient(recipes=recipe, ingredients_id=ingredient_id,
+                              amount=rng.randint(1, 1000))
+             for recipe in recipes
+             for ingredient_id in recipe.ingredient_ids],
+            batch_size=BATCH_SIZE)
+        return recipes
+
+    def create_links(self, model, users, recipes, per_user, rng):
+        # Популярность распределена неравномерно, как в живых данных.
+        weights = list(accumulate(
+            1 / (rank + 1) for rank in range(len(recipes))))
+        objs = []
+        for user in users:
+            chosen = set(rng.choices(recipes, cum_weights=weights,
+                                     k=per_user))
+            objs.extend(model(user=user, recipe=recipe) for recipe in chosen)
+        model.objects.bulk_create(
+            objs, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if options['ingredients']:
+            with transaction.atomic():
+                self.create_ingredients(options['ingredients'], rng)
+                transaction.on_commit(lambda: bump_version('ingredient'))
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        if not ingredient_ids:
+            raise CommandError(
+                'Нет ингредиентов, выполните import_data или '
+                'передайте --ingredients.')
+        with transaction.atomic():
+            tags = self.get_tags()
+            users = self.create_users(options['users'], rng)
+            recipes = self.create_recipes(
+                options['recipes'], users, tags, ingredient_ids,
+                options['ingredients_per_recipe'], rng)
+            rng.shuffle(recipes)
+            self.create_links(Favorite, users, recipes,
+                              options['favorites_per_user'], rng)
+            self.create_links(Shoppinglist, users, recipes,
+                              options['carts_per_user'], rng)
+            subscriptions = [
+                Subscriptions(user=user, subscribing=author)
+                for user in users
+                for author in rng.sample(
+                    users, min(options['subscriptions_per_user'],
+                               len(users)))
+                if author != user
+            ]
+            Subscriptions.objects.bulk_create(
+                subscriptions, batch_size=BATCH_SIZE, ignore_conflicts=True)
+            ShoppingCartItem.objects.rebuild(users)
+            Recipe.objects.recount()
+            Recipe.objects.update_search_vector()
+            transaction.on_commit(lambda: bump_version('recipe'))
+            transaction.on_commit(lambda: bump_version('popularity'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(users)}, '
+            f'рецептов: {len(recipes)}'))
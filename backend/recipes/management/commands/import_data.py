@@ -1,28 +1,106 @@
-from csv import DictReader
-from django.core.management import BaseCommand
+import csv
+import json
+from itertools import islice
+from pathlib import Path
+from time import perf_counter
 
-from recipes.models import Ingredient
+from django.core.management import BaseCommand, CommandError
 
-MODEL_FILE = [
-    (Ingredient, './data/ingredients.csv'),
-]
+from api.cache import bump_version
+from recipes.models import Ingredient, MeasurementUnit
+
+DEFAULT_FILE = './data/ingredients.csv'
+FIELDS = ('name', 'measurement_unit')
+CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield dict(zip(FIELDS, row))
+
+
+def read_json(file):
+    """Потоковое чтение JSON массива объектов без загрузки файла целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    raise CommandError('Ожидался JSON массив.')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise CommandError('Некорректный JSON файл.')
+                break
+            yield item
+        buffer = buffer[position:]
+        if not chunk:
+            raise CommandError('JSON массив не закрыт.')
+
+
+READERS = {
+    '.csv': read_csv,
+    '.json': read_json,
+}
 
 
 class Command(BaseCommand):
-    """Загрузка базы данных из csv файла."""
+    """Загрузка ингредиентов из csv или json файла.
+
+    Файл читается потоково, записи добавляются пачками, уже
+    существующие ингредиенты (unique_ingredient) пропускаются, поэтому
+    связи рецептов с ингредиентами не затрагиваются.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_FILE)
+        parser.add_argument('--batch-size', type=int, default=1000)
 
     def handle(self, *args, **options):
-        for model, fils in MODEL_FILE:
-            fieldnames = ['name', 'measurement_unit']
-            with open(fils, newline='') as csvfile:
-                record = []
-                for row in DictReader(csvfile, fieldnames=fieldnames):
-                    records = model(**row)
-                    record.append(records)
-                if model.objects.exists():
-                    model.objects.all().delete()
-                    self.stdout.write(self.style.SUCCESS(
-                        f'Данные модели {model} удалены!'))
-                model.objects.bulk_create(record)
-                self.stdout.write(self.style.SUCCESS(
-                    f'Данные модели {model} загружены!))'))
+        path = Path(options['path'])
+        reader = READERS.get(path.suffix.lower())
+        if reader is None:
+            raise CommandError(
+                f'Поддерживаются форматы: {", ".join(READERS)}')
+        count_before = Ingredient.objects.count()
+        processed = 0
+        started = perf_counter()
+        with open(path, newline='', encoding='utf-8') as file:
+            rows = (row for row in reader(file) if row.get('name'))
+            while True:
+                batch = [
+                    Ingredient(name=row['name'].strip(),
+                               measurement_unit=row.get(
+                                   'measurement_unit', '').strip())
+                    for row in islice(rows, options['batch_size'])
+                ]
+                if not batch:
+                    break
+                Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+                processed += len(batch)
+                self.stdout.write(
+                    f'Обработано {processed} записей, '
+                    f'{processed / (perf_counter() - started):.0f} в секунду')
+        MeasurementUnit.objects.attach(Ingredient.objects.all())
+        bump_version('ingredient')
+        added = Ingredient.objects.count() - count_before
+        self.stdout.write(self.style.SUCCESS(
+            f'{Ingredient._meta.verbose_name_plural} загружены: '
+            f'добавлено {added}, '
+            f'пропущено {processed - added}.'))
@@ -0,0 +1,23 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from api.cache import bump_version
+from recipes.models import ShoppingCartItem, Shoppinglist
+
+
+class Command(BaseCommand):
+    """Пересчёт списков покупок по таблице Shoppinglist, например после
+    удаления рецептов из админки."""
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            users = set(ShoppingCartItem.objects.values_list(
+                'user_id', flat=True).distinct())
+            users.update(Shoppinglist.objects.values_list(
+                'user_id', flat=True).distinct())
+            ShoppingCartItem.objects.rebuild()
+        # Кэш итогов списка покупок привязан к версии пользователя.
+        for user in users:
+            bump_version(f'user:{user}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Строк в списках покупок: {ShoppingCartItem.objects.count()}'))
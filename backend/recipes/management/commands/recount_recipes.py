@@ -0,0 +1,22 @@
+from django.core.management import BaseCommand
+from django.db.models import F, Q
+
+from api.cache import bump_version
+from recipes.models import Favorite, Recipe, Shoppinglist
+
+
+class Command(BaseCommand):
+    """Сверка счётчиков избранного и списков покупок рецептов."""
+
+    def handle(self, *args, **options):
+        drift = Q()
+        for model in (Favorite, Shoppinglist):
+            field = model.counter_field
+            drift |= ~Q(**{field: F(f'actual_{field}')})
+        drifted = Recipe.objects.with_actual_counts().filter(drift)
+        updated = Recipe.objects.filter(
+            pk__in=drifted.values('pk')).recount()
+        if updated:
+            bump_version('popularity')
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счётчиков рецептов: {updated}'))
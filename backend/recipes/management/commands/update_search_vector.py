@@ -0,0 +1,16 @@
+from django.core.management import BaseCommand
+
+from api.cache import bump_version
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Пересборка поисковых векторов рецептов, например после
+    переименования ингредиентов."""
+
+    def handle(self, *args, **options):
+        updated = Recipe.objects.update_search_vector()
+        if updated:
+            bump_version('recipe')
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено поисковых векторов: {updated}'))
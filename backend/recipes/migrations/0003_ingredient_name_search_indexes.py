@@ -0,0 +1,34 @@
+from django.db import migrations
+
+CREATE_INDEXES = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_upper_like '
+    'ON recipes_ingredient (UPPER(name) varchar_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_upper_trgm '
+    'ON recipes_ingredient USING gin (UPPER(name) gin_trgm_ops)',
+)
+
+DROP_INDEXES = (
+    'DROP INDEX IF EXISTS recipes_ingredient_name_upper_trgm',
+    'DROP INDEX IF EXISTS recipes_ingredient_name_upper_like',
+)
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_auto_20230805_2128'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE_INDEXES), run(DROP_INDEXES)),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:33
+
+from django.db import migrations, models
+
+
+def lowercase_slugs(apps, schema_editor):
+    Tag = apps.get_model('recipes', 'Tag')
+    slugs = set(Tag.objects.values_list('slug', flat=True))
+    for tag in Tag.objects.all():
+        slug = tag.slug.lower()
+        if slug != tag.slug and slug not in slugs:
+            slugs.add(slug)
+            Tag.objects.filter(pk=tag.pk).update(slug=slug)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(lowercase_slugs, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['recipe', 'user'], name='favorite_recipe_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppinglist',
+            index=models.Index(fields=['recipe', 'user'], name='shoppinglist_recipe_user_idx'),
+        ),
+    ]
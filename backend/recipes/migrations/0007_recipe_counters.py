@@ -0,0 +1,41 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:37
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_recipes(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    counters = {
+        'favorites_count': apps.get_model('recipes', 'Favorite'),
+        'in_carts_count': apps.get_model('recipes', 'Shoppinglist'),
+    }
+    Recipe.objects.update(**{
+        field: Coalesce(Subquery(
+            model.objects.filter(recipe=OuterRef('pk')).order_by()
+            .values('recipe').annotate(count=Count('id')).values('count')
+        ), 0)
+        for field, model in counters.items()
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.RunPython(count_recipes, migrations.RunPython.noop),
+    ]
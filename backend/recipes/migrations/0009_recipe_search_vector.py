@@ -0,0 +1,50 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:41
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def fill_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ingredients = RecipeIngredient.objects.filter(
+        recipes=OuterRef('pk')).order_by().values('recipes').annotate(
+            names=StringAgg('ingredients__name', ' ')).values('names')
+    config = settings.SEARCH_CONFIG
+    Recipe.objects.update(search_vector=(
+        SearchVector('name', weight='A', config=config)
+        + SearchVector('text', weight='B', config=config)
+        + SearchVector(Subquery(ingredients), weight='C', config=config)
+    ))
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector_gin '
+        'ON recipes_recipe USING gin (search_vector)')
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'DROP INDEX IF EXISTS recipes_recipe_search_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(fill_search_vector, drop_index),
+    ]
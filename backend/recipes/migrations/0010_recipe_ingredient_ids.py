@@ -0,0 +1,39 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:42
+
+from itertools import groupby
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def fill_ingredient_ids(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    rows = RecipeIngredient.objects.order_by(
+        'recipes_id', 'ingredients_id').values_list(
+            'recipes_id', 'ingredients_id').iterator()
+    batch = []
+    for recipe_id, group in groupby(rows, key=lambda row: row[0]):
+        batch.append(Recipe(
+            pk=recipe_id, ingredient_ids=[pk for _, pk in group]))
+        if len(batch) == BATCH_SIZE:
+            Recipe.objects.bulk_update(batch, ('ingredient_ids',))
+            batch = []
+    Recipe.objects.bulk_update(batch, ('ingredient_ids',))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_ids',
+            field=models.JSONField(blank=True, default=list, editable=False, verbose_name='Отсортированные id ингредиентов'),
+        ),
+        migrations.RunPython(fill_ingredient_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:44
+
+import re
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Единица: (основная единица, количество основных единиц).
+CONVERSIONS = {
+    'г': (None, 1),
+    'кг': ('г', 1000),
+    'мг': ('г', Decimal('0.001')),
+    'мл': (None, 1),
+    'л': ('мл', 1000),
+    'стакан': ('мл', 200),
+    'ст. л.': ('мл', 15),
+    'ч. л.': ('мл', 5),
+}
+
+
+def normalize(name):
+    return ' '.join(re.sub(r'[.,]', ' ', name.lower()).split())
+
+
+def fill_units(apps, schema_editor):
+    MeasurementUnit = apps.get_model('recipes', 'MeasurementUnit')
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    units = {}
+    for name, (base, factor) in CONVERSIONS.items():
+        units[normalize(name)] = MeasurementUnit.objects.create(
+            name=name, key=normalize(name),
+            base=units.get(normalize(base)) if base else None,
+            factor=factor)
+    names = Ingredient.objects.values_list(
+        'measurement_unit', flat=True).distinct()
+    for name in list(names):
+        key = normalize(name)
+        if key not in units:
+            units[key] = MeasurementUnit.objects.create(
+                name=name.strip(), key=key)
+        Ingredient.objects.filter(measurement_unit=name).update(
+            unit=units[key])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_ingredient_ids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeasurementUnit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, verbose_name='Название')),
+                ('key', models.CharField(editable=False, max_length=200, unique=True, verbose_name='Нормализованное название')),
+                ('factor', models.DecimalField(decimal_places=4, default=1, max_digits=12, verbose_name='Количество основных единиц')),
+                ('base', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='derived', to='recipes.measurementunit', verbose_name='Основная единица')),
+            ],
+            options={
+                'verbose_name': 'Единица измерения',
+                'verbose_name_plural': 'Единицы измерения',
+                'ordering': ('name',),
+            },
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='unit',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ingredients', to='recipes.measurementunit', verbose_name='Нормализованная единица'),
+        ),
+        migrations.RunPython(fill_units, migrations.RunPython.noop),
+    ]
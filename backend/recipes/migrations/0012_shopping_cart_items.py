@@ -0,0 +1,50 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:46
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_shopping_cart_items(apps, schema_editor):
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingCartItem = apps.get_model('recipes', 'ShoppingCartItem')
+    rows = RecipeIngredient.objects.filter(
+        recipes__recipe_shoppinglist__isnull=False
+    ).values_list(
+        'recipes__recipe_shoppinglist__user', 'ingredients'
+    ).annotate(total=Sum('amount')).order_by()
+    ShoppingCartItem.objects.bulk_create(
+        (ShoppingCartItem(user_id=user, ingredient_id=pk, amount=total)
+         for user, pk, total in rows.iterator() if total),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0011_measurement_units'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingCartItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(default=0, verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_items', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_items', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Ингредиент списка покупок',
+                'verbose_name_plural': 'Ингредиенты списков покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcartitem',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_cart_item'),
+        ),
+        migrations.RunPython(fill_shopping_cart_items,
+                             migrations.RunPython.noop),
+    ]
@@ -1,10 +1,23 @@
+import re
+from collections import Counter
+from decimal import Decimal
+
 from colorfield.fields import ColorField
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.core.validators import (MaxValueValidator, MinValueValidator,
                                     RegexValidator)
-from django.db import models
+from django.db import connections, models
+from django.db.models import (Case, Count, Exists, ExpressionWrapper, F,
+                              IntegerField, OuterRef, Prefetch, Subquery, Sum,
+                              Value, When)
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
 
 from foodgram.settings import INT_200
-from users.models import User
+from users.models import LinkQuerySet, Subscriptions, User
 
 
 class Tag(models.Model):
@@ -36,6 +49,75 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.slug = self.slug.lower()
+        super().save(*args, **kwargs)
+
+
+class MeasurementUnitQuerySet(models.QuerySet):
+
+    def for_name(self, name):
+        """Единица измерения для строки measurement_unit ингредиента."""
+        unit, _ = self.get_or_create(
+            key=MeasurementUnit.normalize(name),
+            defaults={'name': name.strip()})
+        return unit
+
+    def attach(self, ingredients):
+        """Проставляет единицы ингредиентам, у которых их нет."""
+        ingredients = ingredients.filter(unit__isnull=True)
+        names = ingredients.values_list(
+            'measurement_unit', flat=True).distinct()
+        for name in list(names):
+            ingredients.filter(measurement_unit=name).update(
+                unit=self.for_name(name))
+
+
+class MeasurementUnit(models.Model):
+    """Единица измерения и её перевод в основную единицу."""
+    name = models.CharField(
+        max_length=INT_200,
+        verbose_name='Название'
+    )
+    key = models.CharField(
+        max_length=INT_200,
+        verbose_name='Нормализованное название',
+        unique=True,
+        editable=False
+    )
+    base = models.ForeignKey(
+        'self',
+        on_delete=models.PROTECT,
+        related_name='derived',
+        verbose_name='Основная единица',
+        blank=True,
+        null=True
+    )
+    factor = models.DecimalField(
+        verbose_name='Количество основных единиц',
+        max_digits=12,
+        decimal_places=4,
+        default=1
+    )
+
+    objects = MeasurementUnitQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Единица измерения'
+        verbose_name_plural = 'Единицы измерения'
+        ordering = ('name',)
+
+    def __str__(self):
+        return self.name
+
+    @staticmethod
+    def normalize(name):
+        return ' '.join(re.sub(r'[.,]', ' ', name.lower()).split())
+
+    def save(self, *args, **kwargs):
+        self.key = self.normalize(self.name)
+        super().save(*args, **kwargs)
+
 
 class Ingredient(models.Model):
     """Модель ингредиентов."""
@@ -49,6 +131,15 @@ class Ingredient(models.Model):
         verbose_name='Единицы измерения',
         blank=True
     )
+    unit = models.ForeignKey(
+        MeasurementUnit,
+        on_delete=models.SET_NULL,
+        related_name='ingredients',
+        verbose_name='Нормализованная единица',
+        blank=True,
+        null=True,
+        editable=False
+    )
 
     class Meta:
         verbose_name = "Ингредиент"
@@ -62,6 +153,87 @@ class Ingredient(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if (self.unit is None or MeasurementUnit.normalize(
+                self.measurement_unit) != self.unit.key):
+            self.unit = MeasurementUnit.objects.for_name(
+                self.measurement_unit)
+        super().save(*args, **kwargs)
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Запросы для чтения рецептов без N+1."""
+
+    def change_counter(self, model, delta):
+        """Атомарно меняет счётчик model.counter_field на delta."""
+        field = model.counter_field
+        return self.update(**{field: Greatest(F(field) + delta, 0)})
+
+    def actual_counts(self):
+        return {
+            model.counter_field: Coalesce(Subquery(
+                model.objects.filter(recipe=OuterRef('pk')).order_by()
+                .values('recipe').annotate(count=Count('id'))
+                .values('count')
+            ), 0)
+            for model in (Favorite, Shoppinglist)
+        }
+
+    def with_actual_counts(self):
+        return self.annotate(**{
+            f'actual_{field}': count
+            for field, count in self.actual_counts().items()
+        })
+
+    def recount(self):
+        """Пересчитывает счётчики по таблицам избранного и покупок."""
+        return self.update(**self.actual_counts())
+
+    def update_search_vector(self):
+        """Пересобирает поисковый вектор: название, описание и
+        ингредиенты. Вне PostgreSQL поиск работает по индексу в памяти."""
+        if connections[self.db].vendor != 'postgresql':
+            return 0
+        ingredients = RecipeIngredient.objects.filter(
+            recipes=OuterRef('pk')).order_by().values('recipes').annotate(
+                names=StringAgg('ingredients__name', ' ')).values('names')
+        config = settings.SEARCH_CONFIG
+        return self.update(search_vector=(
+            SearchVector('name', weight='A', config=config)
+            + SearchVector('text', weight='B', config=config)
+            + SearchVector(Subquery(ingredients), weight='C', config=config)
+        ))
+
+    def for_user(self, user):
+        """Подгружает связанные данные и флаги текущего пользователя."""
+        queryset = self.prefetch_related(
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredients')
+            )
+        )
+        if user.is_anonymous:
+            return queryset.select_related('author').annotate(
+                is_favorited=Value(False, output_field=models.BooleanField()),
+                is_in_shopping_cart=Value(
+                    False, output_field=models.BooleanField()),
+            )
+        return queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(Shoppinglist.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+        ).prefetch_related(
+            Prefetch(
+                'author',
+                queryset=User.objects.annotate(subscribed=Exists(
+                    Subscriptions.objects.filter(
+                        user=user, subscribing=OuterRef('pk'))))
+            )
+        )
+
 
 class Recipe(models.Model):
     """Модель для рецептов."""
@@ -83,6 +255,12 @@ class Recipe(models.Model):
         verbose_name='Картинка',
         blank=True
     )
+    image_renditions = models.JSONField(
+        verbose_name='Уменьшенные копии картинки',
+        default=dict,
+        blank=True,
+        editable=False
+    )
     text = models.TextField(
         verbose_name='Описание',
         blank=True
@@ -115,11 +293,43 @@ class Recipe(models.Model):
         auto_now=True,
         editable=False
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False
+    )
+
+    ingredient_ids = models.JSONField(
+        verbose_name='Отсортированные id ингредиентов',
+        default=list,
+        blank=True,
+        editable=False
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['-favorites_count', '-pub_date', '-id'],
+                         name='recipe_popular_idx'),
+            models.Index(fields=['cooking_time', '-pub_date', '-id'],
+                         name='recipe_cooking_time_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -192,18 +402,23 @@ class UserRecipe(models.Model):
         verbose_name='Рецепт',
         on_delete=models.CASCADE)
 
+    objects = LinkQuerySet.as_manager()
+
     class Meta:
         abstract = True
 
 
 class Favorite(UserRecipe):
     """Модель для избранных рецептов."""
+    counter_field = 'favorites_count'
 
     class Meta:
         constraints = [models.UniqueConstraint(
             fields=['user', 'recipe'],
             name='unique_favorite'
         )]
+        indexes = [models.Index(fields=['recipe', 'user'],
+                                name='favorite_recipe_user_idx')]
         ordering = ('recipe',)
         verbose_name = 'Избранное'
         verbose_name_plural = "Избранное"
@@ -214,15 +429,127 @@ class Favorite(UserRecipe):
 
 class Shoppinglist(UserRecipe):
     """Модель для списка покупок."""
+    counter_field = 'in_carts_count'
 
     class Meta:
         constraints = [models.UniqueConstraint(
             fields=['user', 'recipe'],
             name='unique_shopping'
         )]
+        indexes = [models.Index(fields=['recipe', 'user'],
+                                name='shoppinglist_recipe_user_idx')]
         ordering = ('recipe',)
         verbose_name = 'Список покупок'
         verbose_name_plural = "Список покупок"
 
     def __str__(self):
         return f'{self.recipe} {self.user}'
+
+
+class ShoppingCartItemQuerySet(models.QuerySet):
+
+    def apply(self, users, deltas):
+        """Прибавляет {id ингредиента: количество} к спискам users.
+
+        Строки создаются заранее с нулём, поэтому одновременные
+        добавления не конфликтуют, а складываются в UPDATE.
+        """
+        deltas = {pk: delta for pk, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        users = list(users)
+        if not users:
+            return
+        self.bulk_create(
+            [ShoppingCartItem(user_id=user, ingredient_id=pk, amount=0)
+             for user in users for pk, delta in deltas.items() if delta > 0],
+            ignore_conflicts=True)
+        items = self.filter(user__in=users, ingredient__in=deltas)
+        items.update(amount=F('amount') + Case(
+            *(When(ingredient_id=pk, then=Value(delta))
+              for pk, delta in deltas.items()),
+            default=Value(0),
+            output_field=IntegerField(),
+        ))
+        items.filter(amount__lte=0).delete()
+
+    def add_recipes(self, recipes, users, sign=1):
+        """Добавляет (sign=1) или вычитает (sign=-1) ингредиенты рецептов."""
+        deltas = Counter()
+        for pk, amount in RecipeIngredient.objects.filter(
+                recipes__in=recipes).values_list('ingredients_id', 'amount'):
+            deltas[pk] += sign * (amount or 0)
+        self.apply(users, deltas)
+
+    def rebuild(self, users=None):
+        """Пересчитывает списки покупок users (всех при None)."""
+        items = self.all()
+        rows = RecipeIngredient.objects.filter(
+            recipes__recipe_shoppinglist__isnull=False)
+        if users is not None:
+            users = list(users)
+            items = items.filter(user__in=users)
+            rows = rows.filter(recipes__recipe_shoppinglist__user__in=users)
+        items.delete()
+        rows = rows.values_list(
+            'recipes__recipe_shoppinglist__user', 'ingredients'
+        ).annotate(total=Sum('amount')).order_by()
+        self.bulk_create(
+            (ShoppingCartItem(user_id=user, ingredient_id=pk, amount=total)
+             for user, pk, total in rows.iterator() if total),
+            batch_size=1000)
+
+    def totals(self, user):
+        """Суммы ингредиентов списка покупок в основных единицах."""
+        factor = Coalesce('ingredient__unit__factor', Value(Decimal(1)))
+        return self.filter(user=user).values(
+            name=F('ingredient__name'),
+            measurement_unit=Coalesce(
+                'ingredient__unit__base__name', 'ingredient__unit__name',
+                'ingredient__measurement_unit'),
+        ).annotate(amount=Sum(ExpressionWrapper(
+            F('amount') * factor,
+            output_field=models.DecimalField(max_digits=16,
+                                             decimal_places=4)
+        ))).order_by('name', 'measurement_unit')
+
+
+class ShoppingCartItem(models.Model):
+    """Сумма ингредиента по всем рецептам списка покупок пользователя."""
+    user = models.ForeignKey(
+        User,
+        related_name='shopping_cart_items',
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE)
+    ingredient = models.ForeignKey(
+        Ingredient,
+        related_name='shopping_cart_items',
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE)
+    amount = models.IntegerField(
+        verbose_name='Количество',
+        default=0
+    )
+
+    objects = ShoppingCartItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'ingredient'],
+            name='unique_shopping_cart_item'
+        )]
+        verbose_name = 'Ингредиент списка покупок'
+        verbose_name_plural = 'Ингредиенты списков покупок'
+
+    def __str__(self):
+        return f'{self.user} {self.ingredient} {self.amount}'
+
+
+@receiver(pre_delete, sender=Recipe)
+def subtract_from_shopping_carts(instance, **kwargs):
+    """Вычитает рецепт из списков покупок при любом удалении, в том
+    числе каскадном вместе с автором."""
+    ShoppingCartItem.objects.add_recipes(
+        [instance],
+        instance.recipe_shoppinglist.values_list('user_id', flat=True),
+        sign=-1)
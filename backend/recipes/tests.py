@@ -0,0 +1,97 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCartItem, Shoppinglist, Tag)
+from users.models import User
+
+CHANGELIST_QUERIES = {
+    Recipe: 6,
+    Favorite: 4,
+    Shoppinglist: 4,
+}
+
+
+class AdminChangelistQueriesTest(TestCase):
+    """Число запросов списков в админке не зависит от числа строк."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='pass')
+        cls.tag = Tag.objects.create(
+            name='Завтрак', color='#000000', slug='breakfast')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(3)]
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_recipes(self, count):
+        for _ in range(count):
+            index = Recipe.objects.count()
+            author = User.objects.create_user(
+                username=f'user{index}', email=f'user{index}@example.com',
+                password='pass')
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {index}', text='Описание',
+                cooking_time=10)
+            recipe.tags.add(self.tag)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipes=recipe, ingredients=ingredient,
+                                 amount=10)
+                for ingredient in self.ingredients)
+            Favorite.objects.create(user=author, recipe=recipe)
+            Shoppinglist.objects.create(user=author, recipe=recipe)
+
+    def test_changelist_queries(self):
+        for size in (5, 50):
+            self.add_recipes(size - Recipe.objects.count())
+            for model, queries in CHANGELIST_QUERIES.items():
+                url = reverse(
+                    f'admin:recipes_{model._meta.model_name}_changelist')
+                with self.subTest(model=model.__name__, rows=size):
+                    with self.assertNumQueries(queries):
+                        response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(
+                        response.context['cl'].result_count, size)
+
+
+class ShoppingCartOnRecipeDeleteTest(TestCase):
+    """Удалённые рецепты вычитаются из списков покупок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        cls.buyer = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='pass')
+
+    def add_to_cart(self, author, amount):
+        recipe = Recipe.objects.create(
+            author=author, name='Рецепт', text='Описание', cooking_time=10)
+        RecipeIngredient.objects.create(
+            recipes=recipe, ingredients=self.salt, amount=amount)
+        Shoppinglist.objects.create(user=self.buyer, recipe=recipe)
+        ShoppingCartItem.objects.add_recipes([recipe], [self.buyer.pk])
+        return recipe
+
+    def cart(self):
+        return dict(ShoppingCartItem.objects.filter(
+            user=self.buyer).values_list('ingredient__name', 'amount'))
+
+    def test_author_delete_cascade(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass')
+        self.add_to_cart(author, 50)
+        self.add_to_cart(self.buyer, 20)
+        self.assertEqual(self.cart(), {'соль': 70})
+        author.delete()
+        self.assertEqual(self.cart(), {'соль': 20})
+
+    def test_recipe_queryset_delete(self):
+        self.add_to_cart(self.buyer, 50)
+        Recipe.objects.all().delete()
+        self.assertEqual(self.cart(), {})
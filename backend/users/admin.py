@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from recipes.admin import LargeTableAdmin
 from users.models import Subscriptions, User
 
 
@@ -18,5 +19,7 @@ class UserAdmin(admin.ModelAdmin):
 
 
 @admin.register(Subscriptions)
-class SubscriptionsAdmin(admin.ModelAdmin):
+class SubscriptionsAdmin(LargeTableAdmin):
     list_display = ('user', 'subscribing')
+    list_select_related = ('user', 'subscribing')
+    autocomplete_fields = ('user', 'subscribing')
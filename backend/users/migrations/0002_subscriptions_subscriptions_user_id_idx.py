@@ -0,0 +1,17 @@
+# Generated by Django 3.2.3 on 2026-10-18 02:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscriptions',
+            index=models.Index(fields=['user', '-id'], name='subscriptions_user_id_idx'),
+        ),
+    ]
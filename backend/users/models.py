@@ -1,10 +1,121 @@
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
 
 from foodgram.settings import INT_150, INT_254
 
 
+class LinkQuerySet(models.QuerySet):
+    """Связи с уникальной парой полей, которые создаются и удаляются
+    одним запросом с опорой на ограничение уникальности.
+
+    Сигналы post_save и post_delete при этом не отправляются.
+    """
+
+    def _execute(self, sql, values):
+        meta = self.model._meta
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        fields = [meta.get_field(name) for name in values]
+        columns = [quote(field.column) for field in fields]
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(
+                table=quote(meta.db_table),
+                columns=', '.join(columns),
+                placeholders=', '.join(['%s'] * len(columns)),
+                where=' AND '.join(f'{column} = %s' for column in columns),
+            ), [field.get_prep_value(value)
+                for field, value in zip(fields, values.values())])
+            return cursor.rowcount
+
+    def insert_ignore(self, **values):
+        """Создаёт связь, если её нет. True, если строка добавлена."""
+        if connections[self.db].vendor in ('postgresql', 'sqlite'):
+            return self._execute(
+                'INSERT INTO {table} ({columns}) VALUES ({placeholders}) '
+                'ON CONFLICT DO NOTHING', values) == 1
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(**values)
+        except IntegrityError:
+            return False
+        return True
+
+    def delete_link(self, **values):
+        """Удаляет связь. True, если строка была."""
+        return self._execute(
+            'DELETE FROM {table} WHERE {where}', values) > 0
+
+    def _can_return(self):
+        connection = connections[self.db]
+        if connection.vendor == 'sqlite':
+            return connection.Database.sqlite_version_info >= (3, 35)
+        return connection.vendor == 'postgresql'
+
+    def _execute_returning(self, sql, field, keys, values, params):
+        meta = self.model._meta
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        fields = [meta.get_field(name) for name in values]
+        columns = [quote(field.column) for field in fields]
+        key = quote(meta.get_field(field).column)
+        row = '({})'.format(', '.join(['%s'] * (len(columns) + 1)))
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(
+                table=quote(meta.db_table),
+                key=key,
+                columns=', '.join(columns),
+                rows=', '.join([row] * len(keys)),
+                keys=', '.join(['%s'] * len(keys)),
+                where=' AND '.join(f'{column} = %s' for column in columns),
+            ), params)
+            return {pk for pk, in cursor.fetchall()}
+
+    def _prepare(self, field, keys, values):
+        meta = self.model._meta
+        key_field = meta.get_field(field)
+        return (
+            [key_field.get_prep_value(key) for key in keys],
+            [meta.get_field(name).get_prep_value(value)
+             for name, value in values.items()],
+        )
+
+    def insert_ignore_many(self, field, keys, **values):
+        """Создаёт связи values со всеми keys в поле field.
+
+        Возвращает keys, для которых строка действительно добавлена.
+        """
+        keys = list(keys)
+        if not keys:
+            return set()
+        if not self._can_return():
+            return {key for key in keys
+                    if self.insert_ignore(**values, **{field: key})}
+        keys, fixed = self._prepare(field, keys, values)
+        return self._execute_returning(
+            'INSERT INTO {table} ({columns}, {key}) VALUES {rows} '
+            'ON CONFLICT DO NOTHING RETURNING {key}',
+            field, keys, values,
+            [param for key in keys for param in (*fixed, key)])
+
+    def delete_links(self, field, keys, **values):
+        """Удаляет связи values со всеми keys в поле field.
+
+        Возвращает keys, для которых строка действительно удалена.
+        """
+        keys = list(keys)
+        if not keys:
+            return set()
+        if not self._can_return():
+            return {key for key in keys
+                    if self.delete_link(**values, **{field: key})}
+        keys, fixed = self._prepare(field, keys, values)
+        return self._execute_returning(
+            'DELETE FROM {table} WHERE {where} AND {key} IN ({keys}) '
+            'RETURNING {key}',
+            field, keys, values, [*fixed, *keys])
+
+
 class User(AbstractUser):
     """Модель пользователя."""
     username = models.CharField(
@@ -65,10 +176,14 @@ class Subscriptions(models.Model):
         related_name='subscribing'
     )
 
+    objects = LinkQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Подписка на автора'
         verbose_name_plural = 'Подписки на авторов'
         ordering = ('user',)
+        indexes = [models.Index(fields=['user', '-id'],
+                                name='subscriptions_user_id_idx')]
 
         constraints = [
             models.UniqueConstraint(fields=['user', 'subscribing'],